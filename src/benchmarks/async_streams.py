@@ -0,0 +1,72 @@
+"""
+Measures how many concurrent streams a single event loop can serve with
+AsyncReliableTransportProtocol. Run from the src directory:
+
+    python3 -m benchmarks.async_streams [ -c CLIENTS ] [ -n PACKETS ]"""
+
+import argparse
+import asyncio
+import time
+
+from lib.transport.async_transport import AsyncReliableTransportProtocol
+
+LOCALHOST = "127.0.0.1"
+
+
+async def client(target, packets: int, size: int):
+    """
+    Sends the specified amount of packets to the target from a new
+    protocol, and waits for them to be acknowledged."""
+
+    protocol = AsyncReliableTransportProtocol()
+    await protocol.bind((LOCALHOST, 0))
+
+    payload = bytes(size)
+    for _ in range(packets):
+        await protocol.send_to(payload, target)
+
+    await protocol.close()
+
+
+async def run(clients: int, packets: int, size: int) -> float:
+    """
+    Sends packets from every client to a single server, all of them
+    served by the running event loop. Returns the elapsed time in
+    seconds."""
+
+    server = AsyncReliableTransportProtocol()
+    await server.bind((LOCALHOST, 0))
+    target = server.address()
+
+    async def consume():
+        for _ in range(clients * packets):
+            await server.recv_from()
+
+    start = time.monotonic()
+    await asyncio.gather(
+        consume(), *(client(target, packets, size) for _ in range(clients))
+    )
+    elapsed = time.monotonic() - start
+
+    await server.close()
+
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves concurrent streams")
+    parser.add_argument("-c", "--clients", type=int, default=2000)
+    parser.add_argument("-n", "--packets", type=int, default=50)
+    parser.add_argument("-s", "--size", type=int, default=1024)
+    args = parser.parse_args()
+
+    elapsed = asyncio.run(run(args.clients, args.packets, args.size))
+    total = args.clients * args.packets
+    print(
+        f"{args.clients} streams, {total} packets: {elapsed:.3f} s, "
+        f"{total / elapsed:.0f} packets/s"
+    )
+
+
+if __name__ == "__main__":
+    main()
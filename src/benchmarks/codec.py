@@ -0,0 +1,78 @@
+"""
+Measures the encode and decode throughput of every packet type. Run
+from the src directory:
+
+    python3 -m benchmarks.codec [ -n ITERATIONS ]"""
+
+import argparse
+import timeit
+from typing import Callable, Dict, Tuple
+
+from lib.constants import DATASIZE
+from lib.tftp_packet import (
+    TFTPAckPacket,
+    TFTPDataPacket,
+    TFTPErrorPacket,
+    TFTPPacket,
+    TFTPReadRequestPacket,
+    TFTPWriteRequestPacket,
+)
+from lib.transport.transport_packet import (
+    WIDE_SEQUENCE_BYTES,
+    TransportAckPacket,
+    TransportDataPacket,
+    TransportPacket,
+    TransportSackPacket,
+)
+
+PAYLOAD = bytes(DATASIZE)
+RANGES = [(10, 12), (15, 20), (31, 32), (40, 48)]
+
+PACKETS: Dict[str, Tuple[Callable, Callable]] = {
+    "transport ack": (lambda: TransportAckPacket(1000), TransportPacket.decode),
+    "transport data": (
+        lambda: TransportDataPacket(1000, PAYLOAD),
+        TransportPacket.decode,
+    ),
+    "transport data (wide)": (
+        lambda: TransportDataPacket(1000, PAYLOAD, WIDE_SEQUENCE_BYTES),
+        TransportPacket.decode,
+    ),
+    "transport sack": (
+        lambda: TransportSackPacket(5, 30, RANGES),
+        TransportPacket.decode,
+    ),
+    "tftp rrq": (lambda: TFTPReadRequestPacket("file.txt"), TFTPPacket.decode),
+    "tftp wrq": (lambda: TFTPWriteRequestPacket("file.txt"), TFTPPacket.decode),
+    "tftp data": (lambda: TFTPDataPacket(PAYLOAD), TFTPPacket.decode),
+    "tftp ack": (lambda: TFTPAckPacket(), TFTPPacket.decode),
+    "tftp error": (lambda: TFTPErrorPacket(3), TFTPPacket.decode),
+}
+
+
+def measure(function: Callable, iterations: int) -> float:
+    """
+    Returns how many times per second the function can be called, taking
+    the best of three runs."""
+
+    best = min(timeit.repeat(function, number=iterations, repeat=3))
+    return iterations / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the packet codecs")
+    parser.add_argument("-n", "--iterations", type=int, default=100000)
+    args = parser.parse_args()
+
+    print(f"{'packet':<22} {'encode/s':>12} {'decode/s':>12}")
+    for name, (build, decode) in PACKETS.items():
+        data = bytes(build().encode())
+
+        encode_rate = measure(lambda: build().encode(), args.iterations)
+        decode_rate = measure(lambda: decode(data), args.iterations)
+
+        print(f"{name:<22} {encode_rate:>12.0f} {decode_rate:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
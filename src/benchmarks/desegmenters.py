@@ -0,0 +1,108 @@
+"""
+Measures the time it takes to receive a file while writing it to a
+slow disk, writing each segment as it arrives and with the write-behind
+Desegmenter. Run from the src directory:
+
+    python3 -m benchmarks.desegmenters [ -s SIZE ] [ -l LATENCY ]
+        [ -b BANDWIDTH ] [ -r RATE ]
+
+The slow disk is simulated by waiting LATENCY seconds per write, plus
+the time it takes to write the data at BANDWIDTH bytes per second.
+Segments arrive at RATE segments per second."""
+
+import argparse
+import os
+import tempfile
+import time
+
+from lib.constants import DATASIZE
+from lib.segmentation import Desegmenter
+
+
+class SlowDisk:
+    """
+    Cost model of a slow disk."""
+
+    def __init__(self, latency: float, bandwidth: float):
+        self.latency = latency
+        self.bandwidth = bandwidth
+
+    def wait(self, size: int):
+        """
+        Waits for the time it takes to write size bytes."""
+
+        time.sleep(self.latency + size / self.bandwidth)
+
+
+class SlowDesegmenter(Desegmenter):
+    """
+    Write-behind Desegmenter over a slow disk."""
+
+    def __init__(self, file_path: str, size: int, disk: SlowDisk):
+        super().__init__(file_path, size, fsync="never")
+        self.disk = disk
+
+    def _write(self, chunk: bytes):
+        self.disk.wait(len(chunk))
+        super()._write(chunk)
+
+
+class SyncDesegmenter:
+    """
+    Writes each segment as it arrives, on the receiving thread."""
+
+    def __init__(self, file_path: str, size: int, disk: SlowDisk):
+        self.file = open(file_path, "wb")
+        self.disk = disk
+
+    def add_segment(self, data: bytes):
+        self.disk.wait(len(data))
+        self.file.write(data)
+
+    def close(self):
+        self.file.close()
+
+
+def measure(desegmenter, data: bytes, rate: float) -> float:
+    """
+    Returns the time it takes to receive and write the whole data, when
+    segments arrive at the specified rate."""
+
+    start = time.perf_counter()
+    for index, offset in enumerate(range(0, len(data), DATASIZE)):
+        arrival = start + index / rate
+        delay = arrival - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+        desegmenter.add_segment(data[offset : offset + DATASIZE])
+
+    desegmenter.close()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="desegmenter benchmark")
+    parser.add_argument("-s", "--size", type=int, default=32 * 1024 * 1024)
+    parser.add_argument("-l", "--latency", type=float, default=0.0002)
+    parser.add_argument("-b", "--bandwidth", type=float, default=200e6)
+    parser.add_argument("-r", "--rate", type=float, default=10000)
+    arguments = parser.parse_args()
+
+    disk = SlowDisk(arguments.latency, arguments.bandwidth)
+    data = memoryview(os.urandom(arguments.size))
+    ideal = arguments.size / DATASIZE / arguments.rate
+
+    print(f"network bound: {ideal:.2f}s")
+    print(f"{'desegmenter':<14} {'seconds':>8} {'MB/s':>8}")
+    desegmenters = (("sync", SyncDesegmenter), ("write-behind", SlowDesegmenter))
+    for name, desegmenter in desegmenters:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "file")
+            receiver = desegmenter(path, arguments.size, disk)
+            elapsed = measure(receiver, data, arguments.rate)
+            print(f"{name:<14} {elapsed:>8.2f} {arguments.size / elapsed / 1e6:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+"""
+Measures uploads and downloads end to end, running upload.py and
+download.py against start_server.py through an ImpairmentProxy, over a
+grid of file sizes, window sizes and loss rates. Run from the src
+directory:
+
+    python3 -m benchmarks.end_to_end [ -s SIZE ... ] [ -w WINDOW ... ]
+        [ -l LOSS ... ] [ -d DELAY ] [ -j JITTER ] [ -r REORDER ]
+        [ -D DUPLICATE ] [ -b BANDWIDTH ] [ -c ALGORITHM ] [ -n REPEAT ]
+        [ --seed SEED ] [ -o OUTPUT ]
+
+A server is started for each window size (TFTP_WINDOW_SIZE is set for
+the server and the clients), and a proxy for each loss rate. Every
+transfer is checked against the original file. The results are printed
+as a table and written to OUTPUT as JSON, with the goodput (bytes of
+the file per second), the completion time and the retransmissions of
+each transfer, so that runs of different versions can be compared.
+
+Retransmissions are counted on the wire: a data packet is retransmitted
+if the proxy already received a data packet with the same sequence
+number from the same address and session during the transfer. Transfers
+of more than 65536 packets reuse sequence numbers, which are then
+counted as retransmissions too."""
+
+import argparse
+import filecmp
+import json
+import os
+import platform
+import socket as skt
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, Hashable, List, Optional, Set
+
+from benchmarks.impairment_proxy import Impairment, ImpairmentProxy
+from lib.transport.congestion import CONGESTION_CONTROLLERS
+from lib.transport.consts import CONGESTION, Address
+from lib.transport.exceptions import InvalidPacketException
+from lib.transport.transport_packet import TransportDataPacket, TransportPacket
+
+LOCALHOST = "127.0.0.1"
+SOURCE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Seconds a transfer may take before it is considered failed.
+TRANSFER_TIMEOUT = 300.0
+
+
+class RetransmissionCounter:
+    """
+    Observer of an ImpairmentProxy that counts the data packets that
+    are sent more than once."""
+
+    def __init__(self):
+        self.seen: Set[Hashable] = set()
+        self.retransmissions = 0
+
+    def __call__(self, data: bytes, source: Address):
+        try:
+            packet = TransportPacket.decode(data)
+        except InvalidPacketException:
+            return
+
+        if not isinstance(packet, TransportDataPacket):
+            return
+
+        key = (source, packet.session, packet.sequence)
+        if key in self.seen:
+            self.retransmissions += 1
+        self.seen.add(key)
+
+    def take(self) -> int:
+        """
+        Returns the retransmissions counted since the last call, and
+        forgets the packets seen."""
+
+        retransmissions = self.retransmissions
+        self.seen.clear()
+        self.retransmissions = 0
+
+        return retransmissions
+
+
+class Server:
+    """
+    start_server.py running in a process of its own, with a window of
+    the specified size."""
+
+    def __init__(self, storage: str, window: int, congestion: str):
+        self.address = (LOCALHOST, _free_port())
+        self.environment = dict(os.environ, TFTP_WINDOW_SIZE=str(window))
+        arguments = ["-q", "-p", str(self.address[1]), "-s", storage]
+        arguments += ["-c", congestion]
+        self.process = subprocess.Popen(
+            [sys.executable, "start_server.py", *arguments],
+            cwd=SOURCE_DIRECTORY,
+            env=self.environment,
+        )
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+class Benchmark:
+    """
+    Runs the transfers of the grid, and collects their results."""
+
+    def __init__(self, arguments: argparse.Namespace, directory: str):
+        self.arguments = arguments
+        self.directory = directory
+        self.storage = os.path.join(directory, "storage")
+        self.downloads = os.path.join(directory, "downloads")
+        os.mkdir(self.storage)
+        os.mkdir(self.downloads)
+
+        self.results: List[dict] = []
+
+    def run(self):
+        """
+        Runs every transfer of the grid, with a server for each window
+        size and a proxy for each loss rate."""
+
+        files = {size: self._create_file(size) for size in self.arguments.sizes}
+
+        for window in self.arguments.windows:
+            server = Server(self.storage, window, self.arguments.congestion)
+            try:
+                for loss in self.arguments.losses:
+                    self._run_with_proxy(server, window, loss, files)
+            finally:
+                server.close()
+
+    def _run_with_proxy(
+        self, server: Server, window: int, loss: float, files: Dict[int, str]
+    ):
+        """
+        Runs the transfers of every file through a proxy with the
+        specified loss rate."""
+
+        arguments = self.arguments
+        impairment = Impairment(
+            loss,
+            arguments.delay,
+            arguments.jitter,
+            arguments.reorder,
+            arguments.duplicate,
+            arguments.bandwidth,
+        )
+        counter = RetransmissionCounter()
+        proxy = ImpairmentProxy(
+            (LOCALHOST, 0),
+            server.address,
+            impairment,
+            impairment,
+            arguments.seed,
+            counter,
+        )
+        proxy.start()
+
+        try:
+            # Waits for the server to start, without measuring it.
+            self._upload(server, proxy.address(), files[min(files)], "warmup")
+            counter.take()
+
+            for size, path in files.items():
+                for repetition in range(arguments.repeat):
+                    name = f"file_{size}_{window}_{loss}_{repetition}"
+                    for operation in (self._upload, self._download):
+                        result = operation(server, proxy.address(), path, name)
+                        result.update(
+                            size=size,
+                            window=window,
+                            loss=loss,
+                            repetition=repetition,
+                            retransmissions=counter.take(),
+                        )
+                        self._report(result)
+        finally:
+            proxy.close()
+
+    def _upload(self, server: Server, address: Address, path: str, name: str):
+        """
+        Uploads the file with the specified name, and checks it."""
+
+        arguments = ["upload.py", "-s", path, "-n", name]
+        seconds = self._transfer(server, address, arguments)
+        stored = os.path.join(self.storage, name)
+
+        return self._result("upload", seconds, path, stored)
+
+    def _download(self, server: Server, address: Address, path: str, name: str):
+        """
+        Downloads the file with the specified name, and checks it."""
+
+        destination = os.path.join(self.downloads, name)
+        arguments = ["download.py", "-d", destination, "-n", name]
+        seconds = self._transfer(server, address, arguments)
+
+        return self._result("download", seconds, path, destination)
+
+    def _transfer(
+        self, server: Server, address: Address, arguments: List[str]
+    ) -> Optional[float]:
+        """
+        Runs a client script through the proxy. Returns the time it
+        took, or None if it timed out."""
+
+        host, port = address
+        command = [sys.executable, *arguments, "-q", "-H", host, "-p", str(port)]
+        command += ["-c", self.arguments.congestion]
+
+        start = time.perf_counter()
+        try:
+            subprocess.run(
+                command,
+                cwd=SOURCE_DIRECTORY,
+                env=server.environment,
+                timeout=TRANSFER_TIMEOUT,
+            )
+        except subprocess.TimeoutExpired:
+            return None
+
+        return time.perf_counter() - start
+
+    def _result(
+        self, operation: str, seconds: Optional[float], original: str, copy: str
+    ) -> dict:
+        """
+        Returns the result of a transfer, which is correct if the copy
+        matches the original file."""
+
+        ok = seconds is not None and os.path.exists(copy)
+        ok = ok and filecmp.cmp(original, copy, shallow=False)
+        size = os.path.getsize(original)
+
+        return {
+            "operation": operation,
+            "ok": ok,
+            "seconds": seconds,
+            "goodput": size / seconds if ok and seconds else None,
+        }
+
+    def _report(self, result: dict):
+        """
+        Keeps the result, and prints it."""
+
+        self.results.append(result)
+
+        seconds = "-" if result["seconds"] is None else f"{result['seconds']:.2f}"
+        goodput = "-" if result["goodput"] is None else f"{result['goodput'] / 1e6:.2f}"
+        print(
+            f"{result['operation']:<9} {result['size']:>10} {result['window']:>6} "
+            f"{result['loss']:>6.1%} {seconds:>8} {goodput:>8} "
+            f"{result['retransmissions']:>7} {'ok' if result['ok'] else 'FAILED'}"
+        )
+
+    def _create_file(self, size: int) -> str:
+        """
+        Creates a file of random data of the specified size."""
+
+        path = os.path.join(self.directory, f"source_{size}")
+        with open(path, "wb") as file:
+            file.write(os.urandom(size))
+
+        return path
+
+    def report(self) -> dict:
+        """
+        Returns the parameters of the benchmark and its results."""
+
+        arguments = self.arguments
+        impairment = Impairment(
+            delay=arguments.delay,
+            jitter=arguments.jitter,
+            reorder=arguments.reorder,
+            duplicate=arguments.duplicate,
+            bandwidth=arguments.bandwidth,
+        ).as_dict()
+        del impairment["loss"]
+
+        return {
+            "parameters": {
+                "sizes": arguments.sizes,
+                "windows": arguments.windows,
+                "losses": arguments.losses,
+                "impairment": impairment,
+                "congestion": arguments.congestion,
+                "repeat": arguments.repeat,
+                "seed": arguments.seed,
+            },
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": self.results,
+        }
+
+
+def _free_port() -> int:
+    """
+    Returns a UDP port that is free on the loopback interface."""
+
+    with skt.socket(skt.AF_INET, skt.SOCK_DGRAM) as socket:
+        socket.bind((LOCALHOST, 0))
+        return socket.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="end to end benchmark")
+    parser.add_argument("-s", "--sizes", type=int, nargs="+", default=[1000000])
+    parser.add_argument("-w", "--windows", type=int, nargs="+", default=[1, 64])
+    parser.add_argument("-l", "--losses", type=float, nargs="+", default=[0.0, 0.1])
+    parser.add_argument("-d", "--delay", type=float, default=0.0)
+    parser.add_argument("-j", "--jitter", type=float, default=0.0)
+    parser.add_argument("-r", "--reorder", type=float, default=0.0)
+    parser.add_argument("-D", "--duplicate", type=float, default=0.0)
+    parser.add_argument("-b", "--bandwidth", type=float, default=None)
+    parser.add_argument(
+        "-c", "--congestion", choices=CONGESTION_CONTROLLERS.keys(), default=CONGESTION
+    )
+    parser.add_argument("-n", "--repeat", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("-o", "--output", default="end_to_end.json")
+    arguments = parser.parse_args()
+
+    print(
+        f"{'operation':<9} {'size':>10} {'window':>6} {'loss':>6} "
+        f"{'seconds':>8} {'MB/s':>8} {'retrans':>7}"
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        benchmark = Benchmark(arguments, directory)
+        benchmark.run()
+
+    with open(arguments.output, "w") as output:
+        json.dump(benchmark.report(), output, indent=2)
+    print(f"Results written to {arguments.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+"""
+UDP proxy that emulates an impaired link between clients and a server,
+without root privileges or mininet. Run from the src directory:
+
+    python3 -m benchmarks.impairment_proxy -p PORT -t TARGET_PORT
+        [ -l LOSS ] [ -d DELAY ] [ -j JITTER ] [ -r REORDER ]
+        [ -D DUPLICATE ] [ -b BANDWIDTH ] [ --seed SEED ]
+
+Clients send their requests to PORT, and the proxy forwards them to the
+server at TARGET_PORT. Each client is given a socket of its own towards
+the server, and each address the server answers from is given a socket
+of its own towards the clients, so transfers that the server moves to
+another port keep going through the proxy."""
+
+import argparse
+import heapq
+import itertools
+import random
+import select
+import socket as skt
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from lib.transport.consts import MAX_BUFSIZE, Address
+
+LOCALHOST = "127.0.0.1"
+
+UPSTREAM = "upstream"
+DOWNSTREAM = "downstream"
+
+# Extra delay of the datagrams that are reordered, so that the datagrams
+# sent right after them overtake them.
+REORDER_DELAY = 0.01
+# Bytes that may wait for the link when the bandwidth is capped. Datagrams
+# that do not fit are dropped.
+QUEUE_LIMIT = 256 * 1024
+
+Observer = Callable[[bytes, Address], None]
+
+
+class Impairment:
+    """
+    Impairments applied to the datagrams of each direction of the link.
+
+    Probabilities range from 0 to 1, and times are in seconds. Each
+    datagram is lost with probability loss, and otherwise duplicated with
+    probability duplicate. It is delayed by delay, plus or minus a random
+    amount of at most jitter, and with probability reorder it is delayed
+    by reorder_delay more. With a bandwidth (in bytes per second), the
+    datagrams of each direction are sent one after another at that rate,
+    and those that do not fit in a queue of queue_limit bytes are
+    dropped."""
+
+    def __init__(
+        self,
+        loss: float = 0.0,
+        delay: float = 0.0,
+        jitter: float = 0.0,
+        reorder: float = 0.0,
+        duplicate: float = 0.0,
+        bandwidth: Optional[float] = None,
+        reorder_delay: float = REORDER_DELAY,
+        queue_limit: int = QUEUE_LIMIT,
+    ):
+        self.loss = loss
+        self.delay = delay
+        self.jitter = jitter
+        self.reorder = reorder
+        self.duplicate = duplicate
+        self.bandwidth = bandwidth
+        self.reorder_delay = reorder_delay
+        self.queue_limit = queue_limit
+
+    def as_dict(self) -> dict:
+        """
+        Returns the parameters as a dictionary."""
+
+        return dict(vars(self))
+
+
+class ProxyStats:
+    """
+    Counters of the datagrams of a direction of the link."""
+
+    def __init__(self):
+        self.received = 0
+        self.lost = 0
+        self.duplicated = 0
+        self.reordered = 0
+        self.overflowed = 0
+        self.forwarded = 0
+
+    def as_dict(self) -> dict:
+        """
+        Returns the counters as a dictionary."""
+
+        return dict(vars(self))
+
+
+class Link:
+    """
+    A direction of the emulated link. Decides when each datagram is
+    sent, and counts them."""
+
+    def __init__(self, impairment: Impairment, rng: random.Random):
+        self.impairment = impairment
+        self.random = rng
+        self.stats = ProxyStats()
+        self.free_at = 0.0
+
+    def schedule(self, size: int, now: float) -> List[float]:
+        """
+        Returns the times at which a datagram of the specified size,
+        received now, is sent (none if it is dropped, and more than one
+        if it is duplicated)."""
+
+        impairment = self.impairment
+        self.stats.received += 1
+
+        if self.random.random() < impairment.loss:
+            self.stats.lost += 1
+            return []
+
+        copies = 1
+        if self.random.random() < impairment.duplicate:
+            self.stats.duplicated += 1
+            copies = 2
+
+        times = []
+        for _ in range(copies):
+            departure = self._transmit(size, now)
+            if departure is None:
+                self.stats.overflowed += 1
+                continue
+
+            times.append(departure + self._delay())
+
+        return times
+
+    def _transmit(self, size: int, now: float) -> Optional[float]:
+        """
+        Returns the time at which the datagram leaves the link, after the
+        datagrams queued before it, or None if the queue is full."""
+
+        bandwidth = self.impairment.bandwidth
+        if bandwidth is None:
+            return now
+
+        start = max(now, self.free_at)
+        if (start - now) * bandwidth + size > self.impairment.queue_limit:
+            return None
+
+        self.free_at = start + size / bandwidth
+        return self.free_at
+
+    def _delay(self) -> float:
+        """
+        Returns the propagation delay of a datagram."""
+
+        impairment = self.impairment
+        jitter = self.random.uniform(-impairment.jitter, impairment.jitter)
+        delay = max(impairment.delay + jitter, 0.0)
+
+        if self.random.random() < impairment.reorder:
+            self.stats.reordered += 1
+            delay += impairment.reorder_delay
+
+        return delay
+
+
+class ImpairmentProxy:
+    """
+    UDP proxy between clients and a server that impairs the datagrams it
+    forwards, as configured by an Impairment for each direction.
+
+    Every client gets a socket of its own to talk to the server, so that
+    the server sees each client at a different address. Likewise, every
+    address the server answers from gets a socket of its own to talk to
+    the clients, which then send their datagrams for that address to it.
+
+    A single thread forwards the datagrams: it waits until a socket is
+    readable or a delayed datagram is due. If an observer is given, it is
+    called with every datagram the proxy receives, and its source, before
+    the datagram is impaired."""
+
+    def __init__(
+        self,
+        listen_address: Address,
+        target: Address,
+        upstream: Optional[Impairment] = None,
+        downstream: Optional[Impairment] = None,
+        seed: Optional[int] = None,
+        observer: Optional[Observer] = None,
+    ):
+        rng = random.Random(seed)
+        self.links = {
+            UPSTREAM: Link(upstream or Impairment(), rng),
+            DOWNSTREAM: Link(downstream or Impairment(), rng),
+        }
+        self.observer = observer
+
+        self.front = self._socket(listen_address)
+        self.target = target
+
+        # Socket towards the server of each client, and the other way around.
+        self.upstream: Dict[Address, skt.socket] = {}
+        self.client_of: Dict[skt.socket, Address] = {}
+        # Socket towards the clients of each server address, and the other
+        # way around.
+        self.downstream: Dict[Address, skt.socket] = {target: self.front}
+        self.server_of: Dict[skt.socket, Address] = {self.front: target}
+
+        self.pending: List[Tuple[float, int, skt.socket, bytes, Address]] = []
+        self.counter = itertools.count()
+
+        self.closed = False
+        self.wakeup, self.wakeup_peer = skt.socketpair()
+        self.thread = threading.Thread(target=self._run)
+
+    def address(self) -> Address:
+        """
+        Returns the address clients must send their datagrams to."""
+
+        return self.front.getsockname()
+
+    def start(self):
+        """
+        Starts forwarding datagrams in a thread of its own."""
+
+        self.thread.start()
+
+    def close(self):
+        """
+        Stops forwarding datagrams, dropping the delayed ones, and closes
+        every socket."""
+
+        self.closed = True
+        self.wakeup_peer.send(b"\0")
+        self.thread.join()
+
+        for socket in (*self.server_of, *self.client_of):
+            socket.close()
+        self.wakeup.close()
+        self.wakeup_peer.close()
+
+    def stats(self) -> Dict[str, dict]:
+        """
+        Returns the counters of each direction of the link."""
+
+        return {name: link.stats.as_dict() for name, link in self.links.items()}
+
+    def _run(self):
+        """
+        Forwards datagrams until the proxy is closed."""
+
+        while not self.closed:
+            sockets = [self.wakeup, *self.server_of, *self.client_of]
+            readable, _, _ = select.select(sockets, [], [], self._timeout())
+
+            now = time.monotonic()
+            for socket in readable:
+                if socket is not self.wakeup:
+                    self._receive(socket, now)
+
+            self._send_due(time.monotonic())
+
+    def _timeout(self) -> Optional[float]:
+        """
+        Returns the time until the next delayed datagram is due, or None
+        if there are none."""
+
+        if not self.pending:
+            return None
+
+        return max(self.pending[0][0] - time.monotonic(), 0.0)
+
+    def _receive(self, socket: skt.socket, now: float):
+        """
+        Reads a datagram from the socket, and schedules it towards its
+        destination."""
+
+        data, source = socket.recvfrom(MAX_BUFSIZE)
+        if self.observer is not None:
+            self.observer(data, source)
+
+        if socket in self.server_of:
+            link = self.links[UPSTREAM]
+            sender = self._upstream_socket(source)
+            destination = self.server_of[socket]
+        else:
+            link = self.links[DOWNSTREAM]
+            sender = self._downstream_socket(source)
+            destination = self.client_of[socket]
+
+        for due in link.schedule(len(data), now):
+            entry = (due, next(self.counter), sender, data, destination)
+            heapq.heappush(self.pending, entry)
+
+    def _send_due(self, now: float):
+        """
+        Sends the delayed datagrams that are due."""
+
+        while self.pending and self.pending[0][0] <= now:
+            _, _, socket, data, destination = heapq.heappop(self.pending)
+            socket.sendto(data, destination)
+
+            if socket in self.client_of:
+                self.links[UPSTREAM].stats.forwarded += 1
+            else:
+                self.links[DOWNSTREAM].stats.forwarded += 1
+
+    def _upstream_socket(self, client: Address) -> skt.socket:
+        """
+        Returns the socket towards the server of the client."""
+
+        socket = self.upstream.get(client)
+        if socket is None:
+            socket = self.upstream[client] = self._socket((self.target[0], 0))
+            self.client_of[socket] = client
+
+        return socket
+
+    def _downstream_socket(self, server: Address) -> skt.socket:
+        """
+        Returns the socket towards the clients of the server address."""
+
+        socket = self.downstream.get(server)
+        if socket is None:
+            host = self.front.getsockname()[0]
+            socket = self.downstream[server] = self._socket((host, 0))
+            self.server_of[socket] = server
+
+        return socket
+
+    @staticmethod
+    def _socket(address: Address) -> skt.socket:
+        """
+        Returns a UDP socket bound to the address."""
+
+        socket = skt.socket(skt.AF_INET, skt.SOCK_DGRAM)
+        socket.bind(address)
+
+        return socket
+
+
+def main():
+    parser = argparse.ArgumentParser(description="UDP impairment proxy")
+    parser.add_argument("-H", "--host", default=LOCALHOST)
+    parser.add_argument("-p", "--port", type=int, required=True)
+    parser.add_argument("-t", "--target-port", type=int, required=True)
+    parser.add_argument("-T", "--target-host", default=LOCALHOST)
+    parser.add_argument("-l", "--loss", type=float, default=0.0)
+    parser.add_argument("-d", "--delay", type=float, default=0.0)
+    parser.add_argument("-j", "--jitter", type=float, default=0.0)
+    parser.add_argument("-r", "--reorder", type=float, default=0.0)
+    parser.add_argument("-D", "--duplicate", type=float, default=0.0)
+    parser.add_argument("-b", "--bandwidth", type=float, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    arguments = parser.parse_args()
+
+    impairment = Impairment(
+        arguments.loss,
+        arguments.delay,
+        arguments.jitter,
+        arguments.reorder,
+        arguments.duplicate,
+        arguments.bandwidth,
+    )
+    proxy = ImpairmentProxy(
+        (arguments.host, arguments.port),
+        (arguments.target_host, arguments.target_port),
+        impairment,
+        impairment,
+        arguments.seed,
+    )
+    print(f"Forwarding {proxy.address()} to {proxy.target}")
+
+    proxy.start()
+    try:
+        proxy.thread.join()
+    except KeyboardInterrupt:
+        proxy.close()
+        print(proxy.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Compares the throughput of the datagram I/O backends over the loopback
+interface. Run from the src directory:
+
+    python3 -m benchmarks.io_backends [ -n PACKETS ] [ -s SIZE ]"""
+
+import argparse
+import threading
+import time
+
+from lib.transport.datagram_io import IO_BACKENDS
+from lib.transport.transport import ReliableTransportProtocol
+
+LOCALHOST = "127.0.0.1"
+
+
+def run(backend: str, packets: int, size: int) -> float:
+    """
+    Sends the specified amount of packets from one protocol to another,
+    both using the given backend. Returns the elapsed time in seconds."""
+
+    receiver = ReliableTransportProtocol(io_backend=backend)
+    receiver.bind((LOCALHOST, 0))
+    sender = ReliableTransportProtocol(io_backend=backend)
+    target = receiver.socket.getsockname()
+
+    def consume():
+        for _ in range(packets):
+            receiver.recv_from()
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+
+    payload = bytes(size)
+    start = time.monotonic()
+    for _ in range(packets):
+        sender.send_to(payload, target)
+    consumer.join()
+    elapsed = time.monotonic() - start
+
+    sender.close()
+    receiver.close()
+
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the I/O backends")
+    parser.add_argument("-n", "--packets", type=int, default=20000)
+    parser.add_argument("-s", "--size", type=int, default=1024)
+    args = parser.parse_args()
+
+    for backend in IO_BACKENDS:
+        elapsed = run(backend, args.packets, args.size)
+        rate = args.packets / elapsed
+        print(f"{backend:>8}: {elapsed:.3f} s, {rate:.0f} packets/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Measures the throughput of segmenting and encoding a file with each
+segmenter. Run from the src directory:
+
+    python3 -m benchmarks.segmenters [ -s SIZE ] [ -n REPETITIONS ]"""
+
+import argparse
+import os
+import tempfile
+import time
+from typing import Callable, Dict
+
+from lib.segmentation import ChunkedSegmenter, Segmenter
+
+SEGMENTERS: Dict[str, Callable] = {
+    "read": Segmenter,
+    "chunked": ChunkedSegmenter,
+}
+
+
+def measure(segmenter: Callable, file_path: str) -> float:
+    """
+    Returns the time it takes to segment and encode the whole file."""
+
+    start = time.perf_counter()
+    for packet in segmenter(file_path):
+        packet.encode()
+
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="segmenter benchmark")
+    parser.add_argument("-s", "--size", type=int, default=64 * 1024 * 1024)
+    parser.add_argument("-n", "--repetitions", type=int, default=5)
+    arguments = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile() as file:
+        file.write(os.urandom(arguments.size))
+        file.flush()
+
+        print(f"{'segmenter':<12} {'MB/s':>10}")
+        for name, segmenter in SEGMENTERS.items():
+            elapsed = min(
+                measure(segmenter, file.name) for _ in range(arguments.repetitions)
+            )
+            print(f"{name:<12} {arguments.size / elapsed / 1e6:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
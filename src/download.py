@@ -1,6 +1,10 @@
 #!/usr/bin/python3
 from argparse import ArgumentParser
 from lib.client.client import Client
+from lib.client.parallel import ParallelClient
+from lib.client.path_mtu import probe_block_size
+from lib.transport.congestion import CONGESTION_CONTROLLERS
+from lib.transport.consts import CONGESTION
 from lib.logger import create_logger, quiet_log
 
 
@@ -13,7 +17,8 @@ def start_parser() -> "ArgumentParser":
         prog="Download parser",
         description="Allows to parse download flags received by command line",
         usage="download [ -h ] [ -v | -q ] [ -H ADDR ] "
-        + "[ -p PORT ] [ -d FILEPATH ] [ -n FILENAME ]",
+        + "[ -p PORT ] [ -d FILEPATH ] [ -n FILENAME ] [ -c ALGORITHM ] "
+        + "[ -r | -j STREAMS ] [ -b BLKSIZE | --probe-mtu ]",
     )
 
     group = parser.add_mutually_exclusive_group()
@@ -38,6 +43,42 @@ def start_parser() -> "ArgumentParser":
     parser.add_argument("-p", "--port", type=int, help="server port", required=True)
     parser.add_argument("-d", "--dst", help="destination file path", required=True)
     parser.add_argument("-n", "--name", help="file name", required=True)
+    parser.add_argument(
+        "-c",
+        "--congestion",
+        choices=CONGESTION_CONTROLLERS.keys(),
+        default=CONGESTION,
+        help="congestion control algorithm",
+    )
+    transfer = parser.add_mutually_exclusive_group()
+    transfer.add_argument(
+        "-r",
+        "--resume",
+        help="continue an interrupted download",
+        default=False,
+        action="store_true",
+    )
+    transfer.add_argument(
+        "-j",
+        "--streams",
+        help="amount of streams that transfer the file at the same time",
+        default=1,
+        type=int,
+    )
+    block = parser.add_mutually_exclusive_group()
+    block.add_argument(
+        "-b",
+        "--blksize",
+        help="bytes of file data per packet, proposed to the server",
+        default=None,
+        type=int,
+    )
+    block.add_argument(
+        "--probe-mtu",
+        help="propose the largest block size that fits the path MTU",
+        default=False,
+        action="store_true",
+    )
 
     return parser
 
@@ -47,10 +88,31 @@ def main(arguments):
     local_path = arguments.dst
     remote_path = arguments.name
     create_logger(arguments.verbose, arguments.quiet)
+    block_size = arguments.blksize
+    if arguments.probe_mtu:
+        block_size = probe_block_size(address)
     try:
-        Client(address, local_path, remote_path).download()
+        if arguments.streams > 1:
+            ParallelClient(
+                address,
+                local_path,
+                remote_path,
+                arguments.congestion,
+                arguments.streams,
+                block_size,
+            ).download()
+        else:
+            Client(
+                address,
+                local_path,
+                remote_path,
+                arguments.congestion,
+                arguments.resume,
+                block_size=block_size,
+            ).download()
     except Exception as e:
         quiet_log("Error: " + e.__str__())
+        exit(1)
 
 
 if __name__ == "__main__":
@@ -1,14 +1,30 @@
+import os
+import secrets
+from typing import Optional, Tuple
+from lib.constants import (
+    BLKSIZE_OPTION,
+    CHECKSUM_OPTION,
+    DATASIZE,
+    LENGTH_OPTION,
+    OFFSET_OPTION,
+    SESSION_OPTION,
+    TSIZE_OPTION,
+)
 from lib.exceptions import FailedHandshake
 from lib.logger import normal_log, verbose_log
-from lib.transport.consts import Address
+from lib.segmentation import checksum
+from lib.transport.consts import CONGESTION, Address
 from lib.transport.transport import ReliableTransportClient
 from lib.connection import ConnectionRFTP
 from lib.tftp_packet import (
+    Options,
     TFTPAckPacket,
     TFTPErrorPacket,
     TFTPWriteRequestPacket,
     TFTPReadRequestPacket,
     TFTPPacket,
+    block_size_option,
+    int_option,
 )
 
 
@@ -16,61 +32,219 @@ class Client:
     """
     Client interface for the RFTP protocol.
 
-    This class is responsible for downloading and uploading files to the server."""
+    This class is responsible for downloading and uploading files to the server.
+
+    Requests propose a random session to the server. If the server accepts
+    it, the transfer is multiplexed over its listening socket in that
+    session. Otherwise, the transfer is made with the address that answers
+    the request.
+
+    With resume, an interrupted transfer continues where it stopped. The
+    side that holds the partial file announces its length and checksum,
+    and the side that holds the whole file checks them, so the transfer
+    starts over if the partial file does not match.
 
-    def __init__(self, address: Address, local_path: str, remote_path: str):
-        self.socket = ReliableTransportClient(address)
+    If a range is given (as an offset and a length), only that range of
+    the file is transferred, and the rest of the destination file is
+    kept (see ParallelClient)."""
+
+    def __init__(
+        self,
+        address: Address,
+        local_path: str,
+        remote_path: str,
+        congestion: str = CONGESTION,
+        resume: bool = False,
+        file_range: Optional[Tuple[int, int]] = None,
+        block_size: Optional[int] = None,
+    ):
+        self.socket = ReliableTransportClient(address, congestion)
+        self.transfer_socket = self.socket
+        self.session = secrets.randbits(32) or 1
+        self.answer_options: Options = {}
+        self.size: Optional[int] = None
         self.local_path = local_path
         self.remote_path = remote_path
         self.target_address = address
+        self.congestion = congestion
+        self.resume = resume
+        self.file_range = file_range
+        self.block_size = block_size
 
     def upload(self):
         """Attempts to upload a file to the server"""
 
-
         self._send_write_request()
 
+        offset, length = 0, None
+        if self.file_range is not None:
+            offset, length = self.file_range
+        elif (offset := self._upload_offset()) is None:
+            verbose_log("Partial file of the server does not match, starting over")
+            self._reject_answer()
+            Client(
+                self.target_address,
+                self.local_path,
+                self.remote_path,
+                self.congestion,
+                block_size=self.block_size,
+            ).upload()
+            return
+
         normal_log(f"Uploading file: {self.local_path}")
-        ConnectionRFTP(self.socket).send_file(self.local_path)
+        if offset > 0 and self.file_range is None:
+            normal_log(f"Resuming upload at byte {offset}")
+        connection = ConnectionRFTP(self.transfer_socket, self._agreed_block_size())
+        connection.send_file(self.local_path, offset, length)
         normal_log("Finished uploading")
 
-        self.socket.close()
+        self._close()
 
     def download(self):
         """Attempts to download a file from the server"""
 
-        self._send_read_request()
+        proposed = self._send_read_request()
+
+        offset = 0
+        if int_option(self.answer_options, OFFSET_OPTION) == proposed:
+            offset = proposed
+
+        length = None
+        if self.file_range is not None:
+            length = self.file_range[1]
 
         normal_log(f"Downloading file: {self.remote_path}")
-        ConnectionRFTP(self.socket).receive_file(self.local_path)
+        if offset > 0 and self.file_range is None:
+            normal_log(f"Resuming download at byte {offset}")
+        self.size = int_option(self.answer_options, TSIZE_OPTION)
+        connection = ConnectionRFTP(self.transfer_socket)
+        connection.receive_file(self.local_path, self.size, offset, length)
         normal_log("Finished downloading")
 
+        self._close()
+
+    def _agreed_block_size(self) -> int:
+        """
+        Returns the block size agreed on by the server, or the default
+        block size if it did not agree on any."""
+
+        block_size = block_size_option(self.answer_options)
+        if block_size is None:
+            return DATASIZE
+
+        verbose_log(f"Using blocks of {block_size} bytes")
+        return block_size
+
+    def _upload_offset(self):
+        """
+        Returns the offset at which the upload continues, or None if the
+        partial file offered by the server does not match the local file."""
+
+        offset = int_option(self.answer_options, OFFSET_OPTION)
+        if offset is None:
+            return 0
+
+        expected = int_option(self.answer_options, CHECKSUM_OPTION)
+        if offset > os.path.getsize(self.local_path):
+            return None
+        if checksum(self.local_path, offset) != expected:
+            return None
+
+        return offset
+
+    def _reject_answer(self):
+        """
+        Tells the server that the transfer will not take place, and
+        closes the socket."""
+
+        error = FailedHandshake("Resume rejected")
+        self.transfer_socket.send(TFTPErrorPacket.from_exception(error).encode())
+        self._close()
+
+    def _close(self):
+        """
+        Closes the socket, which also waits for the packets sent in the
+        session of the transfer (if any) to be confirmed."""
+
         self.socket.close()
 
+        verbose_log(f"Transport stats: {self.transfer_socket.stats().as_dict()}")
+
     def _send_write_request(self):
         """
         Sends a write request to the server and waits for an answer."""
 
         verbose_log("Sending upload request to server")
-        request = TFTPWriteRequestPacket(self.remote_path).encode()
+        options = self._options()
+        options[TSIZE_OPTION] = str(os.path.getsize(self.local_path))
+        if self.resume:
+            options[OFFSET_OPTION] = options[TSIZE_OPTION]
+        if self.file_range is not None:
+            options.update(self._range_options())
+
+        request = TFTPWriteRequestPacket(self.remote_path, options).encode()
+        self._open_session()
         self.socket.send(request)
 
         self._expect_answer()
 
-    def _send_read_request(self):
+    def _send_read_request(self) -> int:
         """
-        Sends a read request to the server and waits for an answer."""
+        Sends a read request to the server and waits for an answer.
+        Returns the offset proposed to resume the download"""
 
         verbose_log("Sending download request to server")
-        request = TFTPReadRequestPacket(self.remote_path).encode()
+        options = self._options()
+
+        offset = 0
+        if self.file_range is not None:
+            offset = self.file_range[0]
+            options.update(self._range_options())
+        elif self.resume and os.path.exists(self.local_path):
+            offset = os.path.getsize(self.local_path)
+            options[OFFSET_OPTION] = str(offset)
+            options[CHECKSUM_OPTION] = str(checksum(self.local_path, offset))
+
+        request = TFTPReadRequestPacket(self.remote_path, options).encode()
+        self._open_session()
         self.socket.send(request)
 
         self._expect_answer()
+        return offset
+
+    def _options(self):
+        """
+        Options of the requests of the client."""
+
+        options = {SESSION_OPTION: str(self.session)}
+        if self.block_size is not None:
+            options[BLKSIZE_OPTION] = str(self.block_size)
+
+        return options
+
+    def _range_options(self) -> Options:
+        """
+        Options to transfer the range of the file."""
+
+        offset, length = self.file_range
+        return {OFFSET_OPTION: str(offset), LENGTH_OPTION: str(length)}
+
+    def _open_session(self):
+        """
+        Opens the proposed session before sending the request, since the
+        server may send the first packets of the session before its
+        answer arrives. Packets of a session that is not open are dropped."""
+
+        self.transfer_socket = self.socket.open_session(
+            self.target_address, self.session
+        )
 
     def _expect_answer(self):
         """
         Waits for an answer from the server and checks. If it is valid, the
-        client will set the target address to the new address of the server.
+        client will keep the session accepted by the server or, if there is
+        none, discard it and set the target address to the new address of
+        the server.
 
         If it is invalid,
         an exception is raised."""
@@ -79,10 +253,13 @@ class Client:
         answer = TFTPPacket.decode(answer)
         if isinstance(answer, TFTPAckPacket):
             verbose_log("Received AckFPacket from server")
-            self.socket.set_target(address)
+            self.answer_options = answer.options
+            if answer.options.get(SESSION_OPTION) != str(self.session):
+                self._discard_session()
+                self.socket.set_target(address)
             return
 
-
+        self._discard_session()
         self.socket.close()
 
         if isinstance(answer, TFTPErrorPacket):
@@ -92,12 +269,18 @@ class Client:
             verbose_log("Received Invalid Packet from server")
             raise FailedHandshake()
 
-    def _recv_answer(self):
+    def _discard_session(self):
         """
-        Waits for an answer from the server and returns it."""
+        Discards the proposed session, which the server did not accept."""
+
+        self.socket.discard_session(self.target_address, self.session)
+        self.transfer_socket = self.socket
 
+    def _recv_answer(self):
+        """
+        Waits for an answer from the server and returns it. The answer may
+        come from any port of the server, so packets of any source of its
+        host are accepted."""
 
-        while True:
-            answer, address = self.socket.recv_from()
-            if address[0] == self.target_address[0]:
-                return answer, address
+        host = self.target_address[0]
+        return self.socket.recv_from(lambda address: address[0] == host)
@@ -0,0 +1,167 @@
+import os
+from threading import Condition, Thread
+from typing import Callable, List, Optional, Tuple
+
+from lib.client.client import Client
+from lib.constants import BUSY_BACKOFF, BUSY_RETRIES, DATASIZE
+from lib.exceptions import ServerBusy
+from lib.logger import verbose_log
+from lib.transport.consts import CONGESTION, Address
+
+
+def split_ranges(
+    size: int, amount: int, block: int = DATASIZE
+) -> List[Tuple[int, int]]:
+    """
+    Splits a file of the specified size into at most amount ranges of
+    similar length, given as (offset, length). Ranges start at the
+    beginning of a block, and an empty file has a single empty range."""
+
+    packets = max(1, -(-size // block))
+    length = -(-packets // amount) * block
+
+    ranges = [
+        (offset, min(length, size - offset)) for offset in range(0, size, length)
+    ]
+
+    return ranges or [(0, 0)]
+
+
+class ParallelClient:
+    """
+    Client that transfers a single file over several streams at once.
+
+    The file is split into ranges, and each range is transferred by a
+    Client of its own, with its own socket (or session), window and
+    reader thread. Ranges are written at their offset of the destination
+    file, so the file is complete once every range is.
+
+    To split a download, the size of the file is first requested with an
+    empty range, which also creates the destination file with its final
+    size.
+
+    The server limits the transfers that a client runs at the same time,
+    so ranges rejected because it is busy are requested again once
+    another range finishes (or, if none is running, after a backoff). If
+    any range fails, the transfer fails, and a partially downloaded file
+    is removed."""
+
+    def __init__(
+        self,
+        address: Address,
+        local_path: str,
+        remote_path: str,
+        congestion: str = CONGESTION,
+        streams: int = 2,
+        block_size: Optional[int] = None,
+    ):
+        self.address = address
+        self.local_path = local_path
+        self.remote_path = remote_path
+        self.congestion = congestion
+        self.streams = streams
+        self.block_size = block_size
+
+        self.finished = Condition()
+        self.running = 0
+
+    def upload(self):
+        """Attempts to upload a file to the server"""
+
+        size = os.path.getsize(self.local_path)
+        self._transfer(self._split(size), Client.upload)
+
+    def download(self):
+        """Attempts to download a file from the server"""
+
+        try:
+            probe = self._client((0, 0))
+            self._run_range(probe, Client.download)
+
+            size = probe.size or 0
+            self._transfer(self._split(size), Client.download)
+        except Exception:
+            if os.path.exists(self.local_path):
+                os.remove(self.local_path)
+            raise
+
+    def _split(self, size: int) -> List[Tuple[int, int]]:
+        """
+        Splits the file into a range for each stream, aligned to the
+        proposed block size."""
+
+        return split_ranges(size, self.streams, self.block_size or DATASIZE)
+
+    def _transfer(self, ranges: List[Tuple[int, int]], transfer):
+        """
+        Transfers every range at the same time, each one in a thread.
+        Raises the first error of any of them."""
+
+        verbose_log(f"Transferring ranges: {ranges}")
+        errors: List[Optional[Exception]] = [None] * len(ranges)
+
+        def run(index: int, file_range: Tuple[int, int]):
+            try:
+                self._run_range(self._client(file_range), transfer)
+            except Exception as error:
+                errors[index] = error
+
+        threads = [
+            Thread(target=run, args=(index, file_range))
+            for index, file_range in enumerate(ranges)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for error in errors:
+            if error is not None:
+                raise error
+
+    def _run_range(self, client: Client, transfer: Callable[[Client], None]):
+        """
+        Transfers the range of the client, requesting it again while the
+        server is busy. Retries are only counted while no other range is
+        running, since otherwise a slot is freed when that range ends."""
+
+        retries = 0
+        while True:
+            with self.finished:
+                self.running += 1
+            busy = False
+            try:
+                transfer(client)
+                return
+            except ServerBusy:
+                busy = True
+                if retries == BUSY_RETRIES:
+                    raise
+            finally:
+                # Only ranges that end free a slot of the server.
+                with self.finished:
+                    self.running -= 1
+                    if not busy:
+                        self.finished.notify_all()
+
+            with self.finished:
+                others = self.running > 0
+                self.finished.wait(BUSY_BACKOFF * 2**retries)
+            if not others:
+                retries += 1
+
+            verbose_log(f"Server busy, requesting range {client.file_range} again")
+            client = self._client(client.file_range)
+
+    def _client(self, file_range: Tuple[int, int]) -> Client:
+        """
+        Returns a client that transfers the specified range."""
+
+        return Client(
+            self.address,
+            self.local_path,
+            self.remote_path,
+            self.congestion,
+            file_range=file_range,
+            block_size=self.block_size,
+        )
@@ -0,0 +1,82 @@
+import errno
+import socket as skt
+import sys
+import time
+from typing import Optional
+
+from lib.constants import MAX_BLKSIZE, MIN_BLKSIZE
+from lib.transport.consts import MAX_BUFSIZE, Address
+from lib.transport.transport_packet import DATA_HEADER_SIZE
+
+# Socket options of Linux (see ip(7)), not exported by every Python build.
+IP_MTU_DISCOVER = getattr(skt, "IP_MTU_DISCOVER", 10)
+IP_PMTUDISC_DO = getattr(skt, "IP_PMTUDISC_DO", 2)
+IP_MTU = getattr(skt, "IP_MTU", 14)
+
+# Bytes of the IPv4 and UDP headers of a datagram.
+IP_UDP_HEADERS = 28
+# Bytes of the RFTP header of a data packet.
+RFTP_DATA_HEADER = 3
+
+# Probes are transport packets with an invalid operation code, which the
+# server drops.
+PROBE_HEADER = b"\x00\x00"
+PROBE_ATTEMPTS = 3
+# Time given to routers to answer a probe that does not fit in the path.
+PROBE_WAIT = 0.05
+
+
+def probe_block_size(address: Address) -> Optional[int]:
+    """
+    Returns the largest block size whose data packets reach the address
+    without being fragmented, or None if the path MTU can not be
+    discovered (only Linux is supported).
+
+    The path MTU starts at the MTU of the outgoing interface. Probes of
+    that size are sent with the don't fragment bit set: if a router
+    along the path can not forward them, it answers with an ICMP message,
+    and the kernel lowers the path MTU of the socket. Probing stops once
+    the path MTU is stable. If ICMP messages are filtered, the MTU of the
+    interface is used."""
+
+    if not sys.platform.startswith("linux"):
+        return None
+
+    with skt.socket(skt.AF_INET, skt.SOCK_DGRAM) as socket:
+        try:
+            socket.connect(address)
+            socket.setsockopt(skt.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+            mtu = _probe(socket)
+        except OSError:
+            return None
+
+    payload = min(mtu - IP_UDP_HEADERS, MAX_BUFSIZE)
+    block_size = payload - DATA_HEADER_SIZE - RFTP_DATA_HEADER
+
+    return min(max(block_size, MIN_BLKSIZE), MAX_BLKSIZE)
+
+
+def _probe(socket: skt.socket) -> int:
+    """
+    Sends probes through the connected socket until its path MTU is
+    stable, and returns it."""
+
+    mtu = socket.getsockopt(skt.IPPROTO_IP, IP_MTU)
+
+    for _ in range(PROBE_ATTEMPTS):
+        probe = PROBE_HEADER.ljust(min(mtu - IP_UDP_HEADERS, MAX_BUFSIZE), b"\0")
+        try:
+            socket.send(probe)
+        except OSError as error:
+            # The kernel already knows a smaller path MTU.
+            if error.errno != errno.EMSGSIZE:
+                raise
+        else:
+            time.sleep(PROBE_WAIT)
+
+        probed = socket.getsockopt(skt.IPPROTO_IP, IP_MTU)
+        if probed == mtu:
+            break
+        mtu = probed
+
+    return mtu
@@ -3,50 +3,91 @@ Define la interfaz para la implementacion de conexiones de distinto tipo
 """
 
 from abc import ABC
+from lib.constants import DATASIZE
 from lib.exceptions import InvalidPacket
-from lib.segmentation import Desegmenter, Segmenter
+from lib.segmentation import ChunkedSegmenter, Desegmenter
 from lib.tftp_packet import (
     TFTPDataPacket,
     TFTPPacket,
 )
 
+from typing import Iterable, Optional, Union
 from lib.transport.transport import (
     ReliableTransportClient,
+    ReliableTransportSession,
 )
+from lib.transport.transport_packet import Payload
 
 
 class ConnectionRFTP(ABC):
     """
     Responible for sending and receiving files
     using RFTP protocol
+
+    Files are sent in blocks of block_size bytes, the block size
+    agreed on with the other end of the transfer
     """
 
-    def __init__(self, socket: ReliableTransportClient):
+    def __init__(
+        self,
+        socket: Union[ReliableTransportClient, ReliableTransportSession],
+        block_size: int = DATASIZE,
+    ):
         self.socket = socket
+        self.block_size = block_size
 
-    def send_file(self, file_path: str):
+    def send_file(
+        self, file_path: str, offset: int = 0, length: Optional[int] = None
+    ):
         """
         Sends a file using RFTP protocol, segmenting it
-        into smaller packets"""
-        segmenter = Segmenter(file_path)
+        into smaller packets. If an offset is given, the
+        file is sent starting at that byte, and if a length
+        is given, only that amount of bytes is sent"""
+        with ChunkedSegmenter(file_path, self.block_size, offset, length) as segmenter:
+            self.send_packets(packet.encode_parts() for packet in segmenter)
+
+    def send_packets(self, packets: Iterable[Payload]):
+        """
+        Sends already encoded data packets, such as the
+        packets of a file kept in memory. Packets may be
+        given in parts, which are joined by the transport.
+        The last packet asks for an immediate acknowledgment"""
 
-        for packet in segmenter:
-            self.socket.send(packet.encode())
+        previous = None
+        for packet in packets:
+            if previous is not None:
+                self.socket.send(previous)
+            previous = packet
 
-    def receive_file(self, file_path: str):
+        if previous is not None:
+            self.socket.send(previous, last=True)
+
+    def receive_file(
+        self,
+        file_path: str,
+        size: Optional[int] = None,
+        offset: int = 0,
+        length: Optional[int] = None,
+    ):
         """
         Receives a file using RFTP protocol, desegmenting it
-        into a single file"""
+        into a single file. If the size of the file is known,
+        its space is allocated before receiving it. If an
+        offset is given, the file is received after the
+        first offset bytes of the existing file. If a length
+        is given, only that range of the file is received"""
 
-        desegmenter = Desegmenter(file_path)
+        desegmenter = Desegmenter(file_path, size, offset=offset, length=length)
 
-        packet = self._recv_data()
-        desegmenter.add_segment(packet.data)
-        while not packet.fin:
+        try:
             packet = self._recv_data()
             desegmenter.add_segment(packet.data)
-
-        desegmenter.close()
+            while not packet.fin:
+                packet = self._recv_data()
+                desegmenter.add_segment(packet.data)
+        finally:
+            desegmenter.close()
 
     def _recv_data(self):
         """
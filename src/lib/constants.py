@@ -1,6 +1,8 @@
+import os
 import types
 
-from lib.transport.consts import BUFSIZE
+from lib.transport.consts import BUFSIZE, MAX_BUFSIZE
+from lib.transport.transport_packet import DATA_HEADER_SIZE
 
 LOCALHOST = "0.0.0.0"
 DEFAULT_STORAGE = "storage/"
@@ -11,10 +13,63 @@ ERRORCODES.FILEEXISTS = 2
 ERRORCODES.FILENOTEXISTS = 3
 ERRORCODES.INVALIDPACKET = 4
 ERRORCODES.FAILEDHANDSHAKE = 5
+ERRORCODES.SERVERBUSY = 6
 ERRORCODES.UNKNOWN = 0
 
 END = b"\0"
+
+# Option of the requests used to multiplex the transfer in a session of
+# the listening socket of the server.
+SESSION_OPTION = "session"
+# Option with the size of the file being transferred (as in RFC 2349).
+TSIZE_OPTION = "tsize"
+# Options to resume a transfer: the amount of bytes of the file that are
+# already in place, and the CRC-32 of those bytes.
+OFFSET_OPTION = "offset"
+CHECKSUM_OPTION = "checksum"
+# Option to transfer only a range of the file, of this length, starting at
+# the offset (several ranges are transferred at the same time).
+LENGTH_OPTION = "length"
+# Option with the block size proposed by the client, and agreed by the
+# server (as in RFC 2348).
+BLKSIZE_OPTION = "blksize"
 ENDIAN = "big"
 
+# Requests handled at the same time, requests waiting for a free thread,
+# and requests that a single client can run at the same time.
+MAX_TRANSFERS = 16
+MAX_PENDING = 64
+MAX_CLIENT_TRANSFERS = 4
+
+# Times a parallel transfer retries a range rejected because the server is
+# busy while none of its other ranges is running. It waits BUSY_BACKOFF
+# seconds before the first retry, and twice as long before each other one.
+BUSY_RETRIES = 6
+BUSY_BACKOFF = 0.1
+
+# Bytes of files kept in memory by the server to send them again, and
+# size of the largest file that it keeps.
+CACHE_SIZE = 256 * 1024 * 1024
+CACHE_FILE_SIZE = 16 * 1024 * 1024
+
+# Sent files are read in chunks of about READ_SIZE bytes.
+READ_SIZE = 1 << 20
+
+# Received files are written in chunks of WRITE_SIZE bytes, by a thread
+# that holds at most WRITE_BUFFERS chunks waiting to be written.
+WRITE_SIZE = 1 << 20
+WRITE_BUFFERS = 8
+
+# When received files are synced to the disk: once per "file" or "never".
+FSYNC = "file"
+FSYNC_POLICIES = ("file", "never")
+if os.environ.get("TFTP_FSYNC") in FSYNC_POLICIES:
+    FSYNC = os.environ["TFTP_FSYNC"]
+
 # BUFSIZE - HEADERS
-DATASIZE = BUFSIZE - 6 - 3
+DATASIZE = BUFSIZE - DATA_HEADER_SIZE - 3
+
+# Bounds of the block size (data bytes per packet) that a transfer can
+# agree on. Without agreement, blocks have DATASIZE bytes.
+MIN_BLKSIZE = 8
+MAX_BLKSIZE = MAX_BUFSIZE - DATA_HEADER_SIZE - 3
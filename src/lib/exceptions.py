@@ -24,3 +24,8 @@ class InvalidPacket(ErrorPacketException):
 class FilenNotExists(ErrorPacketException):
     def __str__(self) -> str:
         return "Filename does not exist"
+
+
+class ServerBusy(ErrorPacketException):
+    def __str__(self) -> str:
+        return "Server is busy, try again later"
@@ -1,4 +1,10 @@
-from lib.constants import DATASIZE
+import os
+import zlib
+from queue import Queue
+from threading import Thread
+from typing import Iterator, Optional
+
+from lib.constants import DATASIZE, FSYNC, READ_SIZE, WRITE_BUFFERS, WRITE_SIZE
 from lib.tftp_packet import TFTPDataPacket
 
 
@@ -12,17 +18,24 @@ class Segmenter:
     Segmentation is done by reading the file in pairs
     to determine if the the end of the file has been reached
     without reading past the end of the file.
+
+    The file is read without buffering, directly into the
+    buffer of each packet, so its data is only copied again
+    when it is written into a datagram.
+
+    Files are sent with ChunkedSegmenter: this segmenter is
+    only kept as the baseline of benchmarks/segmenters.py
     """
 
     def __init__(self, file_path: str):
-        self.file = open(file_path, "rb")
+        self.file = open(file_path, "rb", buffering=0)
 
-        self.next_packet = self.file.read(DATASIZE)
+        self.next_packet = TFTPDataPacket.read(self.file, DATASIZE)
 
     def advance_read(self):
         """Advances the read buffers sequence"""
         self.prev_packet = self.next_packet
-        self.next_packet = self.file.read(DATASIZE)
+        self.next_packet = TFTPDataPacket.read(self.file, DATASIZE)
 
     def __iter__(self):
         return self
@@ -34,30 +47,267 @@ class Segmenter:
 
         self.advance_read()
 
-        if len(self.prev_packet) == 0:
+        if len(self.prev_packet.data) == 0:
             raise StopIteration
 
-        if len(self.next_packet) == 0:
-            return TFTPDataPacket(self.prev_packet, True)
+        if len(self.next_packet.data) == 0:
+            self.prev_packet.fin = True
+
+        return self.prev_packet
+
+
+def checksum(file_path: str, length: int) -> int:
+    """
+    Returns the CRC-32 of the first length bytes of the file"""
+
+    value = 0
+    if length <= 0:
+        return value
+
+    with open(file_path, "rb") as file:
+        while length > 0:
+            chunk = file.read(min(length, WRITE_SIZE))
+            if not chunk:
+                break
+
+            value = zlib.crc32(chunk, value)
+            length -= len(chunk)
+
+    return value
+
+
+class ChunkedSegmenter:
+    """
+    Segments a file into DataFPackets, reading it in chunks
+
+    The file is read without buffering into chunks of about READ_SIZE
+    bytes, and the data of each packet is a memoryview slice of its
+    chunk, so it is only copied again when the packet is encoded. Each
+    chunk is a new buffer, since the packets that wait for an
+    acknowledgment keep their data.
+
+    The file is not memory mapped: if it is truncated while it is sent
+    (for example, by an upload of the same file), reading it fails with
+    an OSError, while accessing a map would kill the process.
+
+    Since the size of the file is known when it is opened, the fin flag
+    is set on the last segment without reading ahead. An empty file has
+    a single empty segment.
+
+    If an offset is given, segments start at that byte of the file,
+    which is used to resume a transfer. If a length is also given, only
+    that range of the file is segmented.
 
-        return TFTPDataPacket(self.prev_packet)
+    The file is closed once every segment has been read, or by close(),
+    which is called when the segmenter is used as a context manager.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        segment_size: int = DATASIZE,
+        offset: int = 0,
+        length: Optional[int] = None,
+    ):
+        self.segment_size = segment_size
+        self.read_size = max(1, READ_SIZE // segment_size) * segment_size
+        self.offset = offset
+
+        self.file = open(file_path, "rb", buffering=0)
+        self.size = os.fstat(self.file.fileno()).st_size
+
+        self.end = self.size
+        if length is not None:
+            self.end = min(self.size, offset + length)
+
+    def __len__(self) -> int:
+        """
+        Returns the amount of segments of the file"""
+
+        return max(1, -(-(self.end - self.offset) // self.segment_size))
+
+    def __iter__(self) -> Iterator[TFTPDataPacket]:
+        try:
+            yield from self._segments()
+        finally:
+            self.close()
+
+    def _segments(self) -> Iterator[TFTPDataPacket]:
+        """
+        Reads the file chunk by chunk, and yields the segments of each
+        chunk"""
+
+        if self.end <= self.offset:
+            yield TFTPDataPacket(b"", True)
+            return
+
+        self.file.seek(self.offset)
+        position = self.offset
+        while position < self.end:
+            chunk = self._read(min(self.read_size, self.end - position))
+            position += len(chunk)
+
+            for start in range(0, len(chunk), self.segment_size):
+                end = start + self.segment_size
+                last = position == self.end and end >= len(chunk)
+                yield TFTPDataPacket(chunk[start:end], last)
+
+    def _read(self, size: int) -> memoryview:
+        """
+        Reads the next size bytes of the file into a new chunk. Fails if
+        the file ends before them"""
+
+        chunk = memoryview(bytearray(size))
+        read = 0
+        while read < size:
+            count = self.file.readinto(chunk[read:])
+            if not count:
+                raise OSError(f"{self.file.name} was truncated while reading it")
+            read += count
+
+        return chunk
+
+    def close(self):
+        """
+        Closes the file"""
+
+        self.file.close()
+
+    def __enter__(self) -> "ChunkedSegmenter":
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
 
 
 class Desegmenter:
     """
-    Constructs a file from DataFPackets"""
+    Constructs a file from DataFPackets
 
-    def __init__(self, file_path: str):
-        self.file = open(file_path, "wb")
+    Segments are coalesced into chunks of write_size bytes, which are
+    written by a dedicated thread, so a slow disk does not delay the
+    thread that receives the packets. At most WRITE_BUFFERS chunks wait
+    to be written: once they are full, add_segment blocks.
+
+    Every chunk but the last one starts at a multiple of write_size. If
+    the size of the file is known, its space is allocated up front.
+
+    With the "file" fsync policy, the file is synced to the disk when it
+    is closed. With "never", that is left to the operating system.
+
+    If an offset is given, the first offset bytes of the file are kept
+    and segments are written after them, which is used to resume a
+    transfer. Chunks are then aligned to the offset.
+
+    If a length is also given, only that range of the file is written,
+    and the rest of the file is kept, so several desegmenters can write
+    different ranges of the same file at the same time. Chunks are
+    written with positional writes, and the file is not truncated to the
+    end of the range: it is resized to its size instead, if known."""
+
+    def __init__(
+        self,
+        file_path: str,
+        size: Optional[int] = None,
+        fsync: str = FSYNC,
+        write_size: int = WRITE_SIZE,
+        offset: int = 0,
+        length: Optional[int] = None,
+    ):
+        flags = os.O_WRONLY | os.O_CREAT
+        if offset == 0 and length is None:
+            flags |= os.O_TRUNC
+        self.file = open(os.open(file_path, flags, 0o666), "wb", buffering=0)
+        self.ranged = length is not None
+        self.fsync = fsync
+        self.write_size = write_size
+
+        self.buffer = bytearray()
+        self.written = offset
+        self.error: Optional[OSError] = None
+        self.chunks: "Queue[Optional[bytearray]]" = Queue(WRITE_BUFFERS)
+
+        if size is not None and self.ranged:
+            self.file.truncate(size)
+        if size:
+            self._allocate(size)
+
+        self.writer = Thread(target=self._writer, daemon=True)
+        self.writer.start()
+
+    def _allocate(self, size: int):
+        """
+        Allocates the space of the file, so that it is not fragmented
+        and writes do not need to extend it. Ignored if the file system
+        does not support it."""
+
+        if not hasattr(os, "posix_fallocate"):
+            return
+
+        try:
+            os.posix_fallocate(self.file.fileno(), 0, size)
+        except OSError:
+            pass
 
     def add_segment(self, data: bytes):
         """
         Adds a segment to the file"""
 
-        self.file.write(data)
+        if self.error is not None:
+            raise self.error
+
+        self.buffer += data
+        if len(self.buffer) >= self.write_size:
+            aligned = len(self.buffer) - len(self.buffer) % self.write_size
+            chunk, self.buffer = self.buffer, self.buffer[aligned:]
+            del chunk[aligned:]
+
+            self.chunks.put(chunk)
+
+    def _writer(self):
+        """
+        Writes the queued chunks to the file, until the queue is closed
+        with None. Errors are saved to be raised on the receiving thread."""
+
+        while (chunk := self.chunks.get()) is not None:
+            if self.error is not None:
+                continue
+
+            try:
+                self._write(chunk)
+            except OSError as error:
+                self.error = error
+
+    def _write(self, chunk: bytes):
+        """
+        Writes the whole chunk to the file"""
+
+        view = memoryview(chunk)
+        while view:
+            written = os.pwrite(self.file.fileno(), view, self.written)
+            view = view[written:]
+            self.written += written
 
     def close(self):
         """
-        Closes the file"""
+        Writes the remaining segments and closes the file. If the file
+        was allocated with a larger size, it is truncated (unless only a
+        range of the file was written)"""
 
-        self.file.close()
+        if self.buffer:
+            self.chunks.put(self.buffer)
+            self.buffer = bytearray()
+
+        self.chunks.put(None)
+        self.writer.join()
+
+        try:
+            if self.error is not None:
+                raise self.error
+
+            if not self.ranged:
+                self.file.truncate(self.written)
+            if self.fsync == "file":
+                os.fsync(self.file.fileno())
+        finally:
+            self.file.close()
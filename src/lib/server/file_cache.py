@@ -0,0 +1,159 @@
+import os
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from lib.constants import CACHE_FILE_SIZE, CACHE_SIZE, DATASIZE
+from lib.segmentation import ChunkedSegmenter
+
+
+class CacheKey(NamedTuple):
+    """
+    Identifies a version of a file, segmented in blocks of a size. If
+    the file is modified, its modification time or size change, and so
+    does its key."""
+
+    path: str
+    block: int
+    mtime: int
+    size: int
+
+    @property
+    def entry(self) -> Tuple[str, int]:
+        """
+        Identifies the cache entry of the key, which holds a single
+        version of the file for each block size."""
+
+        return self.path, self.block
+
+
+class CacheStats:
+
+    """
+    Counters describing how well the cache is working."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def as_dict(self) -> dict:
+        """
+        Returns the counters as a dictionary."""
+
+        return dict(vars(self))
+
+
+class FileCache:
+
+    """
+    Cache of the encoded data packets of the files sent by the server.
+
+    Files are segmented and encoded once, and every transfer of the
+    same version of a file shares the same packets, which are sent
+    without reading the file again.
+
+    The cache holds at most max_size bytes of encoded packets (headers
+    included), evicting the least recently used files first. Files larger than max_file_size
+    are not cached, so a single file can not take the whole cache. A
+    cached file is discarded as soon as a different version of it is
+    requested.
+
+    Files are cached once for each block size they are requested with,
+    since the packets of each block size are different."""
+
+    def __init__(
+        self, max_size: int = CACHE_SIZE, max_file_size: int = CACHE_FILE_SIZE
+    ):
+        self.max_size = max_size
+        self.max_file_size = min(max_file_size, max_size)
+
+        self.lock = Lock()
+        self.entries: "OrderedDict[Tuple[str, int], CacheKey]" = OrderedDict()
+        self.packets: Dict[CacheKey, List[bytes]] = {}
+        self.sizes: Dict[CacheKey, int] = {}
+        self.loaders: Dict[CacheKey, Lock] = {}
+        self.size = 0
+        self.stats = CacheStats()
+
+    def packets_of(self, path: str, block: int = DATASIZE) -> Optional[List[bytes]]:
+        """
+        Returns the encoded data packets of the file, in blocks of the
+        specified size, loading them if they are not cached. Returns None
+        if the file is too large to be cached."""
+
+        stat = os.stat(path)
+        key = CacheKey(path, block, stat.st_mtime_ns, stat.st_size)
+        if key.size > self.max_file_size:
+            return None
+
+        with self.lock:
+            packets = self._lookup(key)
+            if packets is not None:
+                return packets
+            loader = self.loaders.setdefault(key, Lock())
+
+        # Only one thread loads each file, the rest wait for it.
+        with loader:
+            with self.lock:
+                packets = self._lookup(key)
+                if packets is not None:
+                    return packets
+                self.stats.misses += 1
+
+            try:
+                with ChunkedSegmenter(path, block) as segmenter:
+                    packets = [bytes(packet.encode()) for packet in segmenter]
+            finally:
+                # The loader is removed together with the insertion, so
+                # that no thread finds neither of them and loads it again.
+                with self.lock:
+                    if packets is not None:
+                        self._insert(key, packets)
+                    self.loaders.pop(key, None)
+
+        return packets
+
+    def _lookup(self, key: CacheKey) -> Optional[List[bytes]]:
+        """
+        Returns the cached packets of the file, marking them as recently
+        used, or None if they are not cached. Must be called with the
+        lock held."""
+
+        if self.entries.get(key.entry) != key:
+            return None
+
+        self.entries.move_to_end(key.entry)
+        self.stats.hits += 1
+
+        return self.packets[key]
+
+    def _insert(self, key: CacheKey, packets: List[bytes]):
+        """
+        Caches the packets of the file, replacing any other version of
+        it, and evicts files until the cache fits in its size. Must be
+        called with the lock held."""
+
+        if key.entry in self.entries:
+            self._remove(key.entry)
+            self.stats.invalidations += 1
+
+        size = sum(len(packet) for packet in packets)
+        self.entries[key.entry] = key
+        self.packets[key] = packets
+        self.sizes[key] = size
+        self.size += size
+
+        while self.size > self.max_size:
+            self._remove(next(iter(self.entries)))
+            self.stats.evictions += 1
+
+    def _remove(self, entry: Tuple[str, int]):
+        """
+        Removes the cached packets of the entry. Must be called with the
+        lock held."""
+
+        key = self.entries.pop(entry)
+        del self.packets[key]
+        self.size -= self.sizes.pop(key)
@@ -1,28 +1,62 @@
 import os
-from threading import Thread
+from typing import Dict, Optional
+from lib.constants import (
+    MAX_CLIENT_TRANSFERS,
+    MAX_PENDING,
+    MAX_TRANSFERS,
+    SESSION_OPTION,
+)
+from lib.server.file_cache import FileCache
 from lib.exceptions import FilenNotExists
 from lib.logger import normal_log, verbose_log
+from lib.server.request_scheduler import RequestScheduler
 from lib.tftp_packet import (
     TFTPPacket,
     TFTPReadRequestPacket,
     TFTPWriteRequestPacket,
 )
 from lib.server.worker import ErrorWorker, ReadWorker, WriteWorker
-from lib.transport.consts import Address
+from lib.transport.consts import CONGESTION, Address
+from lib.transport.transport import ReliableTransportProtocol
 from os import path
 
 
 class Handler:
     """
-    Handler for incoming client requests."""
-
-    def __init__(self, root_directory: str):
+    Handler for incoming client requests.
+
+    Requests are handled by a bounded pool of threads (see
+    RequestScheduler).
+
+    If the socket of the server is given, transfers of the clients that
+    propose a session are multiplexed over it, instead of using a socket
+    (and a reader thread) per transfer.
+
+    If a cache is given, downloaded files are sent from it."""
+
+    def __init__(
+        self,
+        root_directory: str,
+        congestion: str = CONGESTION,
+        max_transfers: int = MAX_TRANSFERS,
+        max_pending: int = MAX_PENDING,
+        max_client_transfers: int = MAX_CLIENT_TRANSFERS,
+        socket: Optional[ReliableTransportProtocol] = None,
+        cache: Optional[FileCache] = None,
+    ):
         self.root_directory = root_directory
+        self.congestion = congestion
+        self.socket = socket
+        self.cache = cache
+        self.scheduler = RequestScheduler(
+            max_transfers, max_pending, max_client_transfers
+        )
 
     def handle_request(self, packet: TFTPPacket, address: Address):
         """
-        Handles a request from a client in a separate thread"""
-        Thread(target=self._handle_request, args=[packet, address]).start()
+        Handles a request from a client in a thread of the pool. Raises
+        ServerBusy if there is no room for the request."""
+        self.scheduler.submit(address[0], self._handle_request, packet, address)
 
     def _handle_request(self, request: TFTPPacket, address: Address):
         """
@@ -42,7 +76,16 @@ class Handler:
         absolute_path = self._absolute_path(request.name)
         normal_log(f"Recieved upload request from: {address}")
 
-        WriteWorker(address, absolute_path).run()
+        session = self._session(request.options, address)
+        server_socket = self.socket if session else None
+        WriteWorker(
+            address,
+            absolute_path,
+            self.congestion,
+            server_socket,
+            session,
+            request.options,
+        ).run()
 
     def _handle_read_request(self, request: TFTPReadRequestPacket, address: Address):
         """
@@ -52,10 +95,39 @@ class Handler:
         normal_log(f"Recieved download request from: {address}")
 
         if not path.exists(absolute_path):
-            ErrorWorker(address, FilenNotExists()).run()
+            error = FilenNotExists()
+            ErrorWorker(address, error, self.congestion, self.socket).run()
             return
 
-        ReadWorker(address, absolute_path).run()
+        session = self._session(request.options, address)
+        server_socket = self.socket if session else None
+        ReadWorker(
+            address,
+            absolute_path,
+            self.congestion,
+            server_socket,
+            session,
+            request.options,
+            self.cache,
+        ).run()
+
+    def _session(self, options: Dict[str, str], address: Address) -> int:
+        """
+        Returns the session proposed by the client to multiplex its
+        transfer, or 0 if the transfer must use a socket of its own."""
+
+        if self.socket is None:
+            return 0
+
+        try:
+            session = int(options[SESSION_OPTION])
+        except (KeyError, ValueError):
+            return 0
+
+        if not 0 < session < 1 << 32 or self.socket.has_session(address, session):
+            return 0
+
+        return session
 
     def _absolute_path(self, relative_path: str) -> str:
         """
@@ -0,0 +1,124 @@
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Callable, Deque, Dict, Tuple
+
+from lib.constants import MAX_CLIENT_TRANSFERS, MAX_PENDING, MAX_TRANSFERS
+from lib.exceptions import ServerBusy
+from lib.logger import quiet_log
+
+Task = Tuple[Callable, tuple]
+
+
+class RequestScheduler:
+    """
+    Runs the requests of the clients in a bounded pool of threads.
+
+    At most max_transfers requests run at the same time, and at most
+    max_pending more wait for a free thread. Each client (identified by
+    its host) may run at most max_client_transfers requests at once and
+    keep the same amount waiting, so a single client can not take every
+    thread. Waiting requests are served in round robin between clients.
+
+    Requests that do not fit are rejected with ServerBusy."""
+
+    def __init__(
+        self,
+        max_transfers: int = MAX_TRANSFERS,
+        max_pending: int = MAX_PENDING,
+        max_client_transfers: int = MAX_CLIENT_TRANSFERS,
+    ):
+        self.max_transfers = max_transfers
+        self.max_pending = max_pending
+        self.max_client_transfers = max_client_transfers
+
+        self.executor = ThreadPoolExecutor(max_transfers)
+        self.lock = Lock()
+        self.running = 0
+        self.pending = 0
+        self.client_running: Dict[str, int] = {}
+        self.queues: "OrderedDict[str, Deque[Task]]" = OrderedDict()
+
+    def submit(self, client: str, function: Callable, *args):
+        """
+        Runs the function with the specified arguments on behalf of the
+        client, as soon as there is a free thread. Raises ServerBusy if
+        the request can not be queued."""
+
+        with self.lock:
+            if self._can_run(client):
+                self._run(client, (function, args))
+                return
+
+            queue = self.queues.get(client, ())
+            if self.pending >= self.max_pending or (
+                len(queue) >= self.max_client_transfers
+            ):
+                raise ServerBusy()
+
+            self.queues.setdefault(client, deque()).append((function, args))
+            self.pending += 1
+
+    def _can_run(self, client: str) -> bool:
+        """
+        Returns True if there is a free thread that the client may use."""
+
+        return (
+            self.running < self.max_transfers
+            and self.client_running.get(client, 0) < self.max_client_transfers
+        )
+
+    def _run(self, client: str, task: Task):
+        """
+        Starts the task in the pool. Must be called with the lock held."""
+
+        self.running += 1
+        self.client_running[client] = self.client_running.get(client, 0) + 1
+        self.executor.submit(self._execute, client, task)
+
+    def _execute(self, client: str, task: Task):
+        """
+        Executes the task, and then starts the next waiting request."""
+
+        function, args = task
+        try:
+            function(*args)
+        except Exception as exception:
+            quiet_log("Error occured while handling request: " + str(exception))
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.client_running[client] -= 1
+                if self.client_running[client] == 0:
+                    del self.client_running[client]
+                self._dispatch()
+
+    def _dispatch(self):
+        """
+        Starts the first waiting request, in round robin between clients,
+        whose client may use another thread. Must be called with the lock
+        held."""
+
+        for client in list(self.queues):
+            if not self._can_run(client):
+                continue
+
+            queue = self.queues.pop(client)
+            task = queue.popleft()
+            if queue:
+                self.queues[client] = queue
+            self.pending -= 1
+
+            self._run(client, task)
+            return
+
+    def shutdown(self):
+        """
+        Waits for the running requests to finish. Waiting requests are
+        discarded."""
+
+        with self.lock:
+            self.queues.clear()
+            self.pending = 0
+
+        self.executor.shutdown(wait=True)
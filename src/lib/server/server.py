@@ -1,9 +1,19 @@
 import os
+from lib.constants import (
+    CACHE_SIZE,
+    MAX_CLIENT_TRANSFERS,
+    MAX_PENDING,
+    MAX_TRANSFERS,
+)
+from lib.exceptions import ServerBusy
+from lib.logger import normal_log, verbose_log
 from lib.tftp_packet import (
+    TFTPErrorPacket,
     TFTPPacket,
 )
+from lib.server.file_cache import FileCache
 from lib.server.request_handler import Handler
-from lib.transport.consts import Address
+from lib.transport.consts import CONGESTION, Address
 from lib.transport.transport import ReliableTransportServer
 
 
@@ -12,15 +22,46 @@ class Server:
     Server interface for the RFTP protocol.
 
     This class is responsible for accepting connections from clients and
-    handling their requests."""
+    handling their requests.
+
+    If reuse_port is set, several servers can listen on the same
+    address, each one handling the requests of a subset of the clients.
+
+    Requests that exceed the limits of the request handler are answered
+    with a ServerBusy error from the listening socket, without starting
+    a worker.
 
-    def __init__(self, address: Address, root_directory: str):
-        self.socket = ReliableTransportServer(address)
-        self.request_handler = Handler(root_directory)
+    If multiplex is set, transfers are multiplexed over the listening
+    socket, each one in the session proposed by its client.
+
+    Downloaded files are kept in a cache of cache_size bytes, shared by
+    every transfer of the server. A cache_size of 0 disables it."""
+
+    def __init__(
+        self,
+        address: Address,
+        root_directory: str,
+        congestion: str = CONGESTION,
+        reuse_port: bool = False,
+        max_transfers: int = MAX_TRANSFERS,
+        max_pending: int = MAX_PENDING,
+        max_client_transfers: int = MAX_CLIENT_TRANSFERS,
+        multiplex: bool = False,
+        cache_size: int = CACHE_SIZE,
+    ):
+        self.socket = ReliableTransportServer(address, congestion, reuse_port)
+        self.request_handler = Handler(
+            root_directory,
+            congestion,
+            max_transfers,
+            max_pending,
+            max_client_transfers,
+            self.socket if multiplex else None,
+            FileCache(cache_size) if cache_size > 0 else None,
+        )
         self.address = address
 
-        if not os.path.exists(root_directory):
-            os.makedirs(root_directory)
+        os.makedirs(root_directory, exist_ok=True)
 
 
     def accept(self):
@@ -28,7 +69,11 @@ class Server:
         Accepts a connection from a client and handles its requests."""
 
         data, address = self.socket.recv_from()
-
+        verbose_log(f"Stream table stats: {self.socket.streams.stats.as_dict()}")
 
         packet = TFTPPacket.decode(data)
-        self.request_handler.handle_request(packet, address)
+        try:
+            self.request_handler.handle_request(packet, address)
+        except ServerBusy as error:
+            normal_log(f"Server busy, rejecting request from: {address}")
+            self.socket.send_to(TFTPErrorPacket.from_exception(error).encode(), address)
@@ -1,11 +1,28 @@
+import os
+from itertools import islice
+from typing import Optional
 from lib.connection import ConnectionRFTP
+from lib.constants import (
+    BLKSIZE_OPTION,
+    CHECKSUM_OPTION,
+    DATASIZE,
+    LENGTH_OPTION,
+    OFFSET_OPTION,
+    SESSION_OPTION,
+    TSIZE_OPTION,
+)
 from lib.logger import normal_log, quiet_log, verbose_log
+from lib.segmentation import checksum
+from lib.server.file_cache import FileCache
 from lib.tftp_packet import (
+    Options,
     TFTPErrorPacket,
     TFTPAckPacket,
+    block_size_option,
+    int_option,
 )
-from lib.transport.consts import Address
-from lib.transport.transport import ReliableTransportClient
+from lib.transport.consts import CONGESTION, Address
+from lib.transport.transport import ReliableTransportClient, ReliableTransportProtocol
 from abc import ABC, abstractmethod
 
 
@@ -13,10 +30,32 @@ class Worker(ABC):
     """
     Worker interface for the RFTP protocol.
 
-    This class is responsible for handling requests from clients."""
+    This class is responsible for handling requests from clients.
+
+    By default, each worker exchanges packets with its client through a
+    socket of its own. If the socket of the server is given, the answer
+    to the request is sent from it, and the transfer is multiplexed over
+    it in the specified session."""
 
-    def __init__(self, target_address: Address):
-        self.socket = ReliableTransportClient(target_address)
+    def __init__(
+        self,
+        target_address: Address,
+        congestion: str = CONGESTION,
+        server_socket: Optional[ReliableTransportProtocol] = None,
+        session: int = 0,
+    ):
+        if server_socket is None:
+            self.socket = ReliableTransportClient(target_address, congestion)
+            self.answer_socket = self.socket
+        elif session:
+            self.socket = server_socket.open_session(target_address, session)
+            self.answer_socket = server_socket
+        else:
+            self.socket = self.answer_socket = server_socket
+
+        self.options = {SESSION_OPTION: str(session)} if session else {}
+        self.server_socket = server_socket
+        self.session = session
         self.target = target_address
 
     @abstractmethod
@@ -35,58 +74,202 @@ class Worker(ABC):
         error_packet = TFTPErrorPacket.from_exception(Exception()).encode()
         self.socket.send_to(error_packet, target_address)
 
+    def _send_ack(self):
+        """
+        Accepts the request of the client."""
+
+        ack_packet = TFTPAckPacket(self.options).encode()
+        self.answer_socket.send_to(ack_packet, self.target)
+
+    def _agree_block_size(self, options: Options) -> int:
+        """
+        Accepts the block size proposed by the client (within bounds),
+        adding it to the answer. Without a proposal, blocks have the
+        default size."""
+
+        block_size = block_size_option(options)
+        if block_size is None:
+            return DATASIZE
+
+        self.options[BLKSIZE_OPTION] = str(block_size)
+        return block_size
+
+    def _release(self):
+        """
+        Closes the socket of the worker, or the session of a multiplexed
+        transfer. Closing waits for the FIN of the worker to be
+        acknowledged, answering to the retransmissions of the client in
+        the meantime, or for LINGER seconds at most if the client stops
+        answering. The socket of the server is left open."""
+
+        if self.session or self.server_socket is None:
+            self.socket.close()
+
 
 class ErrorWorker(Worker):
     """
     Worker for sending error packets to clients."""
 
-    def __init__(self, target_address: Address, error: Exception) -> None:
-        super().__init__(target_address)
+    def __init__(
+        self,
+        target_address: Address,
+        error: Exception,
+        congestion: str = CONGESTION,
+        server_socket: Optional[ReliableTransportProtocol] = None,
+    ) -> None:
+        super().__init__(target_address, congestion, server_socket)
 
         self.error = TFTPErrorPacket.from_exception(error).encode()
         verbose_log(f"Sending {error.__class__.__name__} to {target_address}")
 
     def run(self):
-        self.socket.send(self.error)
-        self.socket.close()
+        self.answer_socket.send_to(self.error, self.target)
+        if self.server_socket is None:
+            self.socket.close()
 
 
 class WriteWorker(Worker):
     """
-    Worker for receiving files from clients."""
+    Worker for receiving files from clients.
+
+    If the client asks to resume the upload, the worker offers to keep
+    the bytes of the file that it already has (up to the offset proposed
+    by the client), and answers with their amount and checksum. The
+    client must check them before sending the rest of the file.
+
+    If the client asks to upload a range of the file, only that range is
+    written, keeping the rest of the file.
 
-    def __init__(self, target_address: Address, path_to_file: str):
-        super().__init__(target_address)
+    If the client proposes a block size, the worker agrees on it, and
+    the client sends the file in blocks of that size."""
+
+    def __init__(
+        self,
+        target_address: Address,
+        path_to_file: str,
+        congestion: str = CONGESTION,
+        server_socket: Optional[ReliableTransportProtocol] = None,
+        session: int = 0,
+        options: Optional[Options] = None,
+    ):
+        super().__init__(target_address, congestion, server_socket, session)
         self.connection = ConnectionRFTP(self.socket)
         self.file_path = path_to_file
 
+        options = options or {}
+        self._agree_block_size(options)
+        self.size = int_option(options, TSIZE_OPTION)
+        self.length = int_option(options, LENGTH_OPTION)
+        self.offset = 0
+
+        proposed = int_option(options, OFFSET_OPTION)
+        if self.length is not None:
+            self.offset = proposed or 0
+            if self.size is not None:
+                self.offset = min(self.offset, self.size)
+            self.options[OFFSET_OPTION] = str(self.offset)
+            self.options[LENGTH_OPTION] = str(self.length)
+        elif proposed is not None:
+            if os.path.exists(path_to_file):
+                self.offset = min(proposed, os.path.getsize(path_to_file))
+            self.options[OFFSET_OPTION] = str(self.offset)
+            self.options[CHECKSUM_OPTION] = str(checksum(path_to_file, self.offset))
+
     def run(self):
         try:
-            self.socket.send_to(TFTPAckPacket().encode(), self.target)
+            self._send_ack()
 
             normal_log(f"Recieving file {self.file_path} from {self.target}")
-            self.connection.receive_file(self.file_path)
+            self.connection.receive_file(
+                self.file_path, self.size, self.offset, self.length
+            )
             normal_log(f"File saved at: {self.file_path}")
         except Exception as exception:
             self._on_worker_exception(self.target, exception)
+        finally:
+            self._release()
 
 
 class ReadWorker(Worker):
     """
-    Worker for sending files to clients."""
+    Worker for sending files to clients.
 
-    def __init__(self, target_address: Address, path_to_file: str):
-        super().__init__(target_address)
-        self.connection = ConnectionRFTP(self.socket)
+    If the client asks to resume the download, the worker checks that
+    the bytes that the client already has (announced by their amount
+    and checksum) match the file. If so, it sends the file from there,
+    and otherwise from the start. The answer holds the accepted offset.
+
+    If the client asks to download a range of the file, only that range
+    is sent.
+
+    If the client proposes a block size, the worker agrees on it, and
+    sends the file in blocks of that size."""
+
+    def __init__(
+        self,
+        target_address: Address,
+        path_to_file: str,
+        congestion: str = CONGESTION,
+        server_socket: Optional[ReliableTransportProtocol] = None,
+        session: int = 0,
+        options: Optional[Options] = None,
+        cache: Optional[FileCache] = None,
+    ):
+        super().__init__(target_address, congestion, server_socket, session)
+        options = options or {}
+        self.block_size = self._agree_block_size(options)
+        self.connection = ConnectionRFTP(self.socket, self.block_size)
         self.file_path = path_to_file
+        self.cache = cache
+
+        size = os.path.getsize(path_to_file)
+        self.options[TSIZE_OPTION] = str(size)
+        self.size = size
+        self.offset = 0
+
+        self.length = int_option(options, LENGTH_OPTION)
+        self.end = size
+
+        proposed = int_option(options, OFFSET_OPTION)
+        if self.length is not None:
+            self.offset = min(proposed or 0, size)
+            self.end = min(self.offset + self.length, size)
+            self.options[OFFSET_OPTION] = str(self.offset)
+            self.options[LENGTH_OPTION] = str(self.length)
+        elif proposed is not None:
+            expected = int_option(options, CHECKSUM_OPTION)
+            if proposed <= size and checksum(path_to_file, proposed) == expected:
+                self.offset = proposed
+            self.options[OFFSET_OPTION] = str(self.offset)
 
     def run(self):
         try:
-            self.socket.send(TFTPAckPacket().encode())
+            self._send_ack()
 
             normal_log(f"Sending file {self.file_path} to {self.target}")
-            self.connection.send_file(self.file_path)
+            self._send_file()
             normal_log(f"File sent to {self.target}")
 
         except Exception as exception:
             self._on_worker_exception(self.target, exception)
+        finally:
+            self._release()
+
+    def _send_file(self):
+        """
+        Sends the file, from the cache if there is one and the file
+        fits in it. Resumed downloads and ranges are sent from the cache
+        only if they start at the beginning of a packet and end at the
+        end of the file."""
+
+        packets = None
+        first = self.offset // self.block_size
+        aligned = self.offset % self.block_size == 0
+        if self.cache is not None and aligned and self.end == self.size:
+            packets = self.cache.packets_of(self.file_path, self.block_size)
+            verbose_log(f"File cache stats: {self.cache.stats.as_dict()}")
+
+        if packets is None or first >= len(packets):
+            self.connection.send_file(self.file_path, self.offset, self.length)
+        else:
+            self.connection.send_packets(islice(packets, first, None))
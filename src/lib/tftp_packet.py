@@ -1,5 +1,14 @@
+import struct
 from enum import IntEnum, auto
-from lib.constants import ERRORCODES, ENDIAN, END
+from typing import BinaryIO, Callable, Dict, Optional, Tuple
+from lib.constants import (
+    BLKSIZE_OPTION,
+    ERRORCODES,
+    ENDIAN,
+    END,
+    MAX_BLKSIZE,
+    MIN_BLKSIZE,
+)
 from abc import ABC
 
 from lib.exceptions import (
@@ -7,29 +16,30 @@ from lib.exceptions import (
     FileExists,
     FilenNotExists,
     InvalidPacket,
+    ServerBusy,
 )
 
 
 class _CODES(IntEnum):
     RRQ = auto()
     """
-    |2 bytes |n bytes   |1 byte |
-    |Opcode  |Filename  |0      |
+    |2 bytes |n bytes   |1 byte |n bytes |1 byte |n bytes |1 byte |...
+    |Opcode  |Filename  |0      |Option  |0      |Value   |0      |...
     """
     WRQ = auto()
     """
-    |2 bytes |n bytes   |1 byte |
-    |Opcode  |Filename  |0      |
+    |2 bytes |n bytes   |1 byte |n bytes |1 byte |n bytes |1 byte |...
+    |Opcode  |Filename  |0      |Option  |0      |Value   |0      |...
     """
     DATA = auto()
     """
-    |2 bytes | 1 byte   | 0-DATASIZE bytes |
+    |2 bytes | 1 byte   | 0-BLKSIZE bytes  |
     |Opcode  | Fin      | Data             |
     """
     ACK = auto()
     """
-    |2 bytes |
-    |Opcode  |
+    |2 bytes |n bytes |1 byte |n bytes |1 byte |...
+    |Opcode  |Option  |0      |Value   |0      |...
     """
     ERROR = auto()
     """
@@ -38,9 +48,80 @@ class _CODES(IntEnum):
     """
 
 
+OPCODE = struct.Struct(">H")
+DATA_HEADER = struct.Struct(">HB")
+
+Options = Dict[str, str]
+
+
+def _encode_options(options: Options) -> bytes:
+    """
+    Encodes the options of a packet as a sequence of null terminated
+    names and values"""
+
+    return b"".join(
+        name.encode() + END + value.encode() + END for name, value in options.items()
+    )
+
+
+def _decode_options(stream: bytes) -> Options:
+    """
+    Decodes the options of a packet. Unterminated names or values are
+    ignored, so packets without options decode to an empty dict"""
+
+    fields = bytes(stream).split(END)[:-1]
+    return {
+        name.decode(): value.decode() for name, value in zip(fields[::2], fields[1::2])
+    }
+
+
+def int_option(options: Options, name: str) -> Optional[int]:
+    """
+    Returns the value of a non negative integer option, or None if it
+    is missing or invalid"""
+
+    try:
+        value = int(options[name])
+    except (KeyError, ValueError):
+        return None
+
+    return value if value >= 0 else None
+
+
+def block_size_option(options: Options) -> Optional[int]:
+    """
+    Returns the value of the block size option, limited to the block
+    sizes that can be agreed on, or None if it is missing or invalid"""
+
+    value = int_option(options, BLKSIZE_OPTION)
+    if value is None:
+        return None
+
+    return min(max(value, MIN_BLKSIZE), MAX_BLKSIZE)
+
+
 class TFTPPacket(ABC):
     """
-    Base class for all TFTP packets"""
+    Base class for all TFTP packets
+
+    Packets are decoded from memoryview slices, so the data of a DATA
+    packet is not copied until it is written to the file
+
+    Subclasses are registered in a table of decoders by opcode when
+    they are created"""
+
+    __slots__ = ()
+
+    _decoders: Dict[int, Callable[[bytes], "TFTPPacket"]] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        opcode = cls._opcode()
+        if opcode in TFTPPacket._decoders:
+            raise ValueError(f"duplicated opcode: {opcode}")
+
+        TFTPPacket._decoders[opcode] = cls.decode
 
     @classmethod
     def decode(cls, data: bytes) -> "TFTPPacket":
@@ -48,14 +129,17 @@ class TFTPPacket(ABC):
         Decodes a packet from a stream of bytes. Class of the packet
         depends on the opcode"""
 
-        opcode = int.from_bytes(data[:2], ENDIAN)
-        data = data[2:]
+        view = memoryview(data)
+        try:
+            (opcode,) = OPCODE.unpack_from(view)
+        except struct.error:
+            raise ValueError("invalid opcode")
 
-        for subclass in cls.__subclasses__():
-            if subclass._opcode() == opcode:
-                return subclass.decode(data)
+        decoder = TFTPPacket._decoders.get(opcode)
+        if decoder is None:
+            raise ValueError("invalid opcode")
 
-        raise ValueError("invalid opcode")
+        return decoder(view[OPCODE.size :])
 
     @classmethod
     def _opcode(cls):
@@ -69,47 +153,81 @@ class TFTPPacket(ABC):
         starts with the opcode and then the headers specific to each
         subclass. Base implementation only encodes the opcode"""
 
-        return self._opcode().to_bytes(2, ENDIAN)
+        return OPCODE.pack(self._opcode())
 
 
 class TFTPWriteRequestPacket(TFTPPacket):
-    def __init__(self, name: str):
+    __slots__ = ("name", "options")
+
+    def __init__(self, name: str, options: Optional[Options] = None):
         self.name: str = name
+        self.options: Options = options or {}
 
     @classmethod
     def decode(cls, stream: bytes) -> "TFTPWriteRequestPacket":
-        name, _, stream = stream.partition(END)
-        return cls(name.decode())
+        name, _, stream = bytes(stream).partition(END)
+        return cls(name.decode(), _decode_options(stream))
 
     @classmethod
     def _opcode(cls) -> int:
         return _CODES.WRQ
 
     def encode(self) -> bytes:
-        return super().encode() + self.name.encode() + END
+        return (
+            super().encode()
+            + self.name.encode()
+            + END
+            + _encode_options(self.options)
+        )
 
 
 class TFTPReadRequestPacket(TFTPPacket):
-    def __init__(self, name: str):
+    __slots__ = ("name", "options")
+
+    def __init__(self, name: str, options: Optional[Options] = None):
         self.name: str = name
+        self.options: Options = options or {}
 
     @classmethod
     def decode(cls, stream: bytes) -> "TFTPReadRequestPacket":
-        name, _, stream = stream.partition(END)
-        return cls(name.decode())
+        name, _, stream = bytes(stream).partition(END)
+        return cls(name.decode(), _decode_options(stream))
 
     @classmethod
     def _opcode(cls) -> int:
         return _CODES.RRQ
 
     def encode(self) -> bytes:
-        return super().encode() + self.name.encode() + END
+        return (
+            super().encode()
+            + self.name.encode()
+            + END
+            + _encode_options(self.options)
+        )
 
 
 class TFTPDataPacket(TFTPPacket):
+    __slots__ = ("fin", "data", "buffer")
+
     def __init__(self, data: bytes, fin: bool = False):
         self.fin = fin
         self.data: bytes = data
+        self.buffer: Optional[memoryview] = None
+
+    @classmethod
+    def read(cls, file: BinaryIO, size: int) -> "TFTPDataPacket":
+        """
+        Reads up to size bytes of the file into a new packet. The data
+        is read right after the space of the header, so encoding the
+        packet does not copy it"""
+
+        buffer = memoryview(bytearray(DATA_HEADER.size + size))
+        length = file.readinto(buffer[DATA_HEADER.size :])
+
+        packet = cls(buffer[DATA_HEADER.size : DATA_HEADER.size + length])
+        packet.buffer = buffer[: DATA_HEADER.size + length]
+
+        return packet
 
     @classmethod
     def decode(cls, stream: bytes):
@@ -123,23 +241,45 @@ class TFTPDataPacket(TFTPPacket):
         return _CODES.DATA
 
     def encode(self) -> bytes:
-        return super().encode() + self.fin.to_bytes(1, ENDIAN) + self.data
+        if self.buffer is None:
+            return DATA_HEADER.pack(self._opcode(), self.fin) + self.data
+
+        DATA_HEADER.pack_into(self.buffer, 0, self._opcode(), self.fin)
+        return self.buffer
+
+    def encode_parts(self) -> Tuple[bytes, ...]:
+        """
+        Encodes the packet as its header followed by its data, without
+        copying the data. The transport joins the parts when it encodes
+        its own packet, which is then the only copy of the data"""
+
+        if self.buffer is not None:
+            return (self.encode(),)
+
+        return (DATA_HEADER.pack(self._opcode(), self.fin), self.data)
 
 
 class TFTPAckPacket(TFTPPacket):
-    def __init__(self):
-        pass
+    __slots__ = ("options",)
+
+    def __init__(self, options: Optional[Options] = None):
+        self.options: Options = options or {}
 
     @classmethod
-    def decode(cls, _: bytes) -> "TFTPAckPacket":
-        return cls()
+    def decode(cls, stream: bytes) -> "TFTPAckPacket":
+        return cls(_decode_options(stream))
 
     @classmethod
     def _opcode(cls) -> int:
         return _CODES.ACK
 
+    def encode(self) -> bytes:
+        return super().encode() + _encode_options(self.options)
+
 
 class TFTPErrorPacket(TFTPPacket):
+    __slots__ = ("error_code",)
+
     def __init__(self, error_code: int):
         self.error_code: int = error_code
 
@@ -169,6 +309,9 @@ class TFTPErrorPacket(TFTPPacket):
         if isinstance(exception, InvalidPacket):
             return cls(ERRORCODES.INVALIDPACKET)
 
+        if isinstance(exception, ServerBusy):
+            return cls(ERRORCODES.SERVERBUSY)
+
         return cls(ERRORCODES.UNKNOWN)
 
     def get_fail_reason(self) -> Exception:
@@ -180,5 +323,7 @@ class TFTPErrorPacket(TFTPPacket):
             return FailedHandshake()
         if self.error_code == ERRORCODES.INVALIDPACKET:
             return InvalidPacket()
+        if self.error_code == ERRORCODES.SERVERBUSY:
+            return ServerBusy()
 
         return Exception("Some unknown error occured")
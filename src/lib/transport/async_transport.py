@@ -0,0 +1,338 @@
+import asyncio
+from typing import List, Optional, Tuple
+
+from lib.transport.consts import (
+    CONGESTION,
+    MAX_STREAMS,
+    RECV_BUFFER,
+    SEQUENCE_BITS,
+    STREAM_IDLE_TIMEOUT,
+    WINDOW_SIZE,
+    Address,
+)
+from lib.transport.datagram_io import DatagramWriter
+from lib.transport.exceptions import (
+    InvalidAddress,
+    InvalidPacketException,
+    SendingNoneData,
+    StreamLimitReached,
+)
+from lib.transport.scheduler import TimerHandle
+from lib.transport.stats import TransportStats
+from lib.transport.stream import ReliableStream
+from lib.transport.stream_table import StreamTable
+from lib.transport.transport_packet import (
+    Payload,
+    Received,
+    TransportFinAckPacket,
+    TransportFinPacket,
+    TransportPacket,
+)
+
+
+class LoopTimerHandle(TimerHandle):
+
+    """
+    A deadline registered in a LoopScheduler. Cancelling it also removes
+    the callback from the event loop."""
+
+    def __init__(self, deadline: float, callback, args):
+        super().__init__(deadline, callback, args)
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+    def cancel(self):
+        super().cancel()
+        self.timer.cancel()
+
+
+class LoopScheduler:
+
+    """
+    Schedules the deadlines of every stream of an asynchronous protocol
+    in its event loop, with the same interface as RetransmissionScheduler.
+
+    As in RetransmissionScheduler, cancelling a handle only marks it, and
+    its callback is skipped when the deadline expires."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.running = True
+
+    def schedule(self, delay: float, callback, *args) -> TimerHandle:
+        """
+        Registers a callback to be executed after the specified delay
+        (in seconds). Returns a handle that can be used to cancel it."""
+
+        handle = LoopTimerHandle(self.loop.time() + delay, callback, args)
+        handle.timer = self.loop.call_later(delay, self._run, handle)
+
+        return handle
+
+    def _run(self, handle: TimerHandle):
+        """
+        Executes the callback of an expired deadline, unless it has been
+        cancelled or the scheduler has been stopped."""
+
+        if self.running and not handle.cancelled:
+            handle.callback(*handle.args)
+
+    def stop(self):
+        """
+        Discards every pending deadline."""
+
+        self.running = False
+
+
+class LoopCondition:
+
+    """
+    Replaces the window condition of ReliableStream in an event loop.
+
+    Since every callback runs in the same thread, entering the condition
+    does nothing. Waiting suspends the current task until the condition
+    is notified, which wakes up every waiting task so that each of them
+    checks its predicate again."""
+
+    def __init__(self):
+        self.waiters: List[asyncio.Future] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def notify(self):
+        waiters, self.waiters = self.waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def wait(self):
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        await waiter
+
+
+class TransportDatagramWriter(DatagramWriter):
+
+    """
+    Writes datagrams through an asyncio datagram transport. Datagrams are
+    read by the event loop, which delivers them to the protocol."""
+
+    def __init__(self, transport: asyncio.DatagramTransport):
+        self.transport = transport
+
+    def send(self, data: bytes, address: Address):
+        self.transport.sendto(data, address)
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncReliableStream(ReliableStream):
+
+    """
+    Implementation of ReliableStream for an event loop. Sending suspends
+    the calling task (instead of blocking the thread) until the packet
+    fits in the window, and received packets are queued in an
+    asyncio.Queue.
+
+    The packets sent are the same as those of ReliableStream, so both
+    implementations can talk to each other."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.window = LoopCondition()
+
+    async def send(self, data: Payload, last: bool = False):
+        """
+        Sends a data packet to the specified recipient. If the window
+        size is reached, it waits until an acknowledgment is received.
+        The last packet of a transfer is acknowledged immediately."""
+
+        window_full = await self._acquire_window()
+        self._send_next(data, window_full or last)
+
+    async def _acquire_window(self) -> bool:
+        while (
+            self.in_flight >= self.congestion.window
+            or not self._peer_accepts(self.next_seq.value)
+        ):
+            await self.window.wait()
+        self.in_flight += 1
+
+        return self.in_flight >= self.congestion.window
+
+    def _queue_packet(self, data: Received):
+        self.queued += 1
+        self.recv_queue.put_nowait((data, self.target))
+
+    async def drain(self):
+        """
+        Waits until every sent packet has been acknowledged, or abandoned
+        because the stream is closing and the recipient does not answer."""
+
+        while self.has_unacked_packets():
+            await self.window.wait()
+
+
+class AsyncReliableTransportProtocol(asyncio.DatagramProtocol):
+
+    """
+    Implementation of ReliableTransportProtocol for asyncio.
+
+    Every stream is served by the event loop that runs the protocol: the
+    received datagrams are delivered by the loop, and retransmissions are
+    scheduled with loop.call_later, so no thread is created per stream
+    (or at all). Sending and receiving are coroutines.
+
+    The protocol must be bound with bind() before it is used. It is
+    compatible on the wire with ReliableTransportProtocol, and keeps its
+    streams in a StreamTable as well."""
+
+    def __init__(
+        self,
+        window_size: int = WINDOW_SIZE,
+        congestion: str = CONGESTION,
+        sequence_bits: int = SEQUENCE_BITS,
+        recv_buffer: int = RECV_BUFFER,
+        max_streams: int = MAX_STREAMS,
+        stream_idle_timeout: float = STREAM_IDLE_TIMEOUT,
+    ):
+        self.window_size = window_size
+        self.congestion = congestion
+        self.sequence_bits = sequence_bits
+        self.recv_buffer = recv_buffer
+
+        self.recv_queue: asyncio.Queue = asyncio.Queue()
+        self.streams = StreamTable(max_streams, stream_idle_timeout)
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.io: Optional[TransportDatagramWriter] = None
+        self.scheduler: Optional[LoopScheduler] = None
+
+    async def bind(self, address: Address = ("0.0.0.0", 0)):
+        """
+        Creates the socket of the protocol in the running event loop, and
+        asociates it to the specified address (any port by default)."""
+
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(lambda: self, local_addr=address)
+
+    def connection_made(self, transport: asyncio.DatagramTransport):
+        self.transport = transport
+        self.io = TransportDatagramWriter(transport)
+        self.scheduler = LoopScheduler(asyncio.get_running_loop())
+
+    def datagram_received(self, data: bytes, address: Address):
+        try:
+            packet = TransportPacket.decode(data)
+        except InvalidPacketException:
+            return
+
+        # Sessions are not supported, every packet belongs to session 0.
+        if packet.session != 0:
+            return
+
+        stream = self.streams.get(address)
+        if stream is None:
+            if isinstance(packet, TransportFinPacket):
+                # The stream was released, and its FIN-ACK lost.
+                answer = TransportFinAckPacket(packet.sequence, packet.sequence_bytes)
+                self.io.send(answer.encode(), address)
+                return
+
+            # Late duplicates of a released stream must not create another.
+            if self.streams.was_released(address):
+                return
+
+            try:
+                stream = self._stream_for_address(address)
+            except StreamLimitReached:
+                return
+
+        stream.handle_packet(packet)
+        if stream.peer_finished:
+            self.streams.release(address)
+
+    def error_received(self, exc: Exception):
+        pass
+
+    def address(self) -> Address:
+        """
+        Returns the address the socket is bound to."""
+
+        return self.transport.get_extra_info("sockname")
+
+    async def recv_from(self) -> Tuple[Received, Address]:
+        """
+        Receives a data packet from any source. If no packets have been
+        received yet, it waits until one is received. The data is a view
+        of the received datagram."""
+
+        data, address = await self.recv_queue.get()
+
+        stream = self.streams.get(address)
+        if stream is not None:
+            stream.consumed()
+            if stream.peer_finished:
+                self.streams.release(address)
+
+        return data, address
+
+    async def send_to(self, data: bytes, target: Address):
+        """
+        Sends a data packet to the specified recipient. If the window of
+        the recipient is full, it waits until there is space."""
+
+        if data is None:
+            raise SendingNoneData()
+
+        if target[0] is None or target[1] is None:
+            raise InvalidAddress()
+
+        await self._stream_for_address(target).send(data)
+
+    def _stream_for_address(self, address: Address) -> AsyncReliableStream:
+        """
+        Returns the stream corresponding to the specified address,
+        creating it if it does not exist (raising StreamLimitReached if
+        the table is full)."""
+
+        stream = self.streams.get(address)
+        if stream is not None:
+            return stream
+
+        return self.streams.get_or_create(
+            address,
+            lambda: AsyncReliableStream(
+                self.io,
+                address,
+                self.recv_queue,
+                self.scheduler,
+                self.window_size,
+                self.congestion,
+                self.sequence_bits,
+                self.recv_buffer,
+            ),
+        )
+
+    def stats(self) -> TransportStats:
+        """
+        Returns the aggregated loss recovery counters of every stream."""
+
+        return self.streams.transport_stats()
+
+    async def close(self):
+        """
+        Closes the socket, once every sent packet has been confirmed (or
+        the recipient is assumed to be gone, as in ReliableTransportProtocol)."""
+
+        streams = list(self.streams.values())
+        for stream in streams:
+            stream.close()
+
+        await asyncio.gather(*(stream.drain() for stream in streams))
+
+        self.scheduler.stop()
+        self.io.close()
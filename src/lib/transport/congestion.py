@@ -0,0 +1,189 @@
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Type
+
+from lib.transport.consts import INITIAL_CWND
+
+
+class CongestionController(ABC):
+
+    """
+    Determines how many packets a stream may have in flight, reacting
+    to acknowledgments and losses.
+
+    The congestion window (cwnd) is measured in packets and never
+    exceeds the maximum window of the stream. Losses of packets that
+    were sent before the last window reduction belong to the same loss
+    event and are ignored, so a burst of timeouts only reduces the
+    window once."""
+
+    def __init__(self, max_window: int):
+        self.max_window = max_window
+        self.cwnd = float(min(INITIAL_CWND, max_window))
+        self.ssthresh = float(max_window)
+        self.last_reduction = 0.0
+
+    @property
+    def window(self) -> int:
+        """
+        Amount of packets that may be in flight."""
+
+        return max(1, min(int(self.cwnd), self.max_window))
+
+    def on_ack(self, rtt: Optional[float]):
+        """
+        Executes when a data packet is acknowledged. The round trip time
+        of the packet is given if it could be measured."""
+
+        if self.cwnd < self.ssthresh:
+            self.cwnd += 1
+        else:
+            self._congestion_avoidance(rtt)
+
+        self.cwnd = min(self.cwnd, self.max_window)
+
+    def on_timeout(self, sent_at: float):
+        """
+        Executes when the deadline of a packet sent at the specified
+        time (as given by time.monotonic) expires."""
+
+        if self._new_loss_event(sent_at):
+            self._reduce()
+            self.cwnd = 1.0
+
+    def on_loss(self, sent_at: float):
+        """
+        Executes when a packet sent at the specified time is detected as
+        lost from the acknowledgments of later packets. Since packets are
+        still being delivered, the window is not collapsed (fast recovery)."""
+
+        if self._new_loss_event(sent_at):
+            self._reduce()
+            self.cwnd = max(self.ssthresh, 1.0)
+
+    def _new_loss_event(self, sent_at: float) -> bool:
+        """
+        Returns True if the loss of a packet sent at the specified time
+        starts a new loss event."""
+
+        if sent_at < self.last_reduction:
+            return False
+
+        self.last_reduction = time.monotonic()
+        return True
+
+    @abstractmethod
+    def _congestion_avoidance(self, rtt: Optional[float]):
+        """
+        Increases the window after slow start has finished."""
+        pass
+
+    @abstractmethod
+    def _reduce(self):
+        """
+        Updates the state of the controller after a loss event."""
+        pass
+
+
+class FixedWindow(CongestionController):
+
+    """
+    Disables congestion control. The window is always the maximum
+    window of the stream."""
+
+    def __init__(self, max_window: int):
+        super().__init__(max_window)
+        self.cwnd = float(max_window)
+
+    def on_ack(self, rtt: Optional[float]):
+        pass
+
+    def on_timeout(self, sent_at: float):
+        pass
+
+    def on_loss(self, sent_at: float):
+        pass
+
+    def _congestion_avoidance(self, rtt: Optional[float]):
+        pass
+
+    def _reduce(self):
+        pass
+
+
+class RenoController(CongestionController):
+
+    """
+    Additive increase, multiplicative decrease. The window grows by one
+    packet per round trip and is halved on each loss event."""
+
+    def _congestion_avoidance(self, rtt: Optional[float]):
+        self.cwnd += 1 / self.cwnd
+
+    def _reduce(self):
+        self.ssthresh = max(self.cwnd / 2, 2.0)
+
+
+class CubicController(CongestionController):
+
+    """
+    CUBIC congestion control (RFC 8312). After a loss event, the window
+    grows following a cubic function of the time elapsed, which makes it
+    independent of the round trip time and quickly recovers the window
+    that was in use before the loss.
+
+    The window never grows slower than Reno would."""
+
+    C = 0.4
+    BETA = 0.7
+
+    def __init__(self, max_window: int):
+        super().__init__(max_window)
+        self.w_max = 0.0
+        self.w_last_max = 0.0
+        self.w_est = 0.0
+        self.k = 0.0
+        self.origin = 0.0
+        self.epoch_start: Optional[float] = None
+
+    def _congestion_avoidance(self, rtt: Optional[float]):
+        now = time.monotonic()
+        if self.epoch_start is None:
+            self.epoch_start = now
+            self.w_est = self.cwnd
+            if self.cwnd < self.w_max:
+                self.k = ((self.w_max - self.cwnd) / self.C) ** (1 / 3)
+                self.origin = self.w_max
+            else:
+                self.k = 0.0
+                self.origin = self.cwnd
+
+        elapsed = now - self.epoch_start + (rtt or 0.0)
+        target = self.origin + self.C * (elapsed - self.k) ** 3
+
+        self.w_est += 3 * (1 - self.BETA) / (1 + self.BETA) / self.cwnd
+        target = max(target, self.w_est)
+
+        if target > self.cwnd:
+            self.cwnd += (target - self.cwnd) / self.cwnd
+        else:
+            self.cwnd += 0.01 / self.cwnd
+
+    def _reduce(self):
+        self.epoch_start = None
+
+        if self.cwnd < self.w_last_max:
+            self.w_last_max = self.cwnd
+            self.w_max = self.cwnd * (1 + self.BETA) / 2
+        else:
+            self.w_last_max = self.cwnd
+            self.w_max = self.cwnd
+
+        self.ssthresh = max(self.cwnd * self.BETA, 2.0)
+
+
+CONGESTION_CONTROLLERS: Dict[str, Type[CongestionController]] = {
+    "none": FixedWindow,
+    "reno": RenoController,
+    "cubic": CubicController,
+}
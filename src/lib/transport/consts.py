@@ -3,9 +3,28 @@ from typing import Tuple
 
 
 TIMER = 0.1
+MIN_RTO = 0.02
+MAX_RTO = 1.0
 BUFSIZE = 4096
+# Largest UDP payload over IPv4. Datagrams are read with this size, so
+# that transfers can agree on larger datagrams than BUFSIZE.
+MAX_BUFSIZE = 65507
+RECV_BATCH = 64
+IO_BACKEND = "batched"
 WINDOW_SIZE = 30
-DROP_THRESHOLD = 50
+RECV_BUFFER = 64
+INITIAL_CWND = 4
+CONGESTION = "reno"
+# Seconds that a closing stream waits for a silent peer before giving up
+# on the packets that it has not acknowledged.
+LINGER = 2.0
+ACK_EVERY = 16
+ACK_DELAY = 0.005
+DUPLICATE_THRESHOLD = 3
+# Streams held by a protocol at once, and seconds after which a stream
+# without activity (nor pending packets) is released.
+MAX_STREAMS = 4096
+STREAM_IDLE_TIMEOUT = 60.0
 
 try:
     env_window_size = int(os.environ["TFTP_WINDOW_SIZE"])
@@ -13,4 +32,16 @@ try:
 except (KeyError, ValueError):
     pass
 
+try:
+    RECV_BUFFER = int(os.environ["TFTP_RECV_BUFFER"])
+except (KeyError, ValueError):
+    pass
+
+CONGESTION = os.environ.get("TFTP_CONGESTION", CONGESTION)
+IO_BACKEND = os.environ.get("TFTP_IO_BACKEND", IO_BACKEND)
+
+SEQUENCE_BITS = 16
+if os.environ.get("TFTP_SEQUENCE_BITS") == "32":
+    SEQUENCE_BITS = 32
+
 Address = Tuple[str, int]
@@ -0,0 +1,199 @@
+import os
+import select
+import socket as skt
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Dict, List, Tuple, Type
+
+from lib.transport.consts import MAX_BUFSIZE, RECV_BATCH, Address
+
+
+class DatagramWriter(ABC):
+
+    """
+    Writes the datagrams of the streams of a transport protocol. This is
+    all a stream needs from the I/O of its protocol: how datagrams are
+    read depends on the protocol."""
+
+    @abstractmethod
+    def send(self, data: bytes, address: Address):
+        """
+        Sends a datagram to the specified address."""
+        pass
+
+    @abstractmethod
+    def close(self):
+        """
+        Releases the resources associated with the writer."""
+        pass
+
+
+class DatagramIO(DatagramWriter):
+
+    """
+    Reads and writes the datagrams of a transport protocol, with one
+    system call per datagram.
+
+    Reads block until a datagram arrives or until the reader is woken up
+    with wakeup(), which writes to a pipe polled together with the
+    socket (the self-pipe trick). This lets the reader stop as soon as
+    it must, instead of periodically checking it."""
+
+    def __init__(self, socket: skt.socket, bufsize: int = MAX_BUFSIZE):
+        self.socket = socket.dup()
+        self.socket.setblocking(False)
+        self.bufsize = bufsize
+
+        self.wakeup_reader, self.wakeup_writer = os.pipe()
+        os.set_blocking(self.wakeup_reader, False)
+        os.set_blocking(self.wakeup_writer, False)
+
+        self.poller = select.poll()
+        self.poller.register(self.socket, select.POLLIN)
+        self.poller.register(self.wakeup_reader, select.POLLIN)
+
+    def recv_batch(self) -> List[Tuple[bytes, Address]]:
+        """
+        Waits for datagrams and returns the ones received, together with
+        the address of their sender. Returns an empty list if the reader
+        is woken up before any is received."""
+
+        if not self._wait_readable():
+            return []
+
+        try:
+            return [self.socket.recvfrom(self.bufsize)]
+        except skt.error:
+            return []
+
+    def send(self, data: bytes, address: Address):
+        """
+        Sends a datagram to the specified address."""
+
+        # No lock is taken, by either backend: sendto writes each datagram
+        # as a whole, so the streams can send from any thread at once.
+        self._sendto(data, address)
+
+    @contextmanager
+    def batch(self):
+        """
+        Groups the datagrams sent by the current thread inside the
+        context, so that they can be written together when it exits.
+        The base implementation sends them immediately."""
+
+        yield
+
+    def wakeup(self):
+        """
+        Wakes up the reader blocked in recv_batch, if any, so that it
+        checks whether it must stop. Can be called from any thread."""
+
+        try:
+            os.write(self.wakeup_writer, b"\0")
+        except BlockingIOError:
+            # The pipe is full, so the reader will be woken up anyway.
+            pass
+
+    def close(self):
+        """
+        Releases the resources associated with the backend."""
+
+        self.socket.close()
+        os.close(self.wakeup_reader)
+        os.close(self.wakeup_writer)
+
+    def _wait_readable(self) -> bool:
+        """
+        Blocks until the socket is readable or the reader is woken up.
+        Returns True if the socket is readable."""
+
+        readable = False
+        for fd, _ in self.poller.poll():
+            if fd == self.wakeup_reader:
+                self._clear_wakeups()
+            else:
+                readable = True
+
+        return readable
+
+    def _clear_wakeups(self):
+        """
+        Discards the pending wakeups of the reader."""
+
+        try:
+            while os.read(self.wakeup_reader, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _sendto(self, data: bytes, address: Address):
+        """
+        Sends a datagram, waiting for space in the socket buffer if it
+        is full."""
+
+        while True:
+            try:
+                self.socket.sendto(data, address)
+                return
+            except BlockingIOError:
+                select.select([], [self.socket], [], 1)
+
+
+class BatchedDatagramIO(DatagramIO):
+
+    """
+    Reads and writes datagrams in batches.
+
+    After waiting for the socket to be readable, every datagram already
+    queued in the socket (up to RECV_BATCH) is drained without blocking,
+    so a single wakeup handles a whole burst of datagrams.
+
+    Datagrams sent by a thread inside a batch() context are kept in a
+    per-thread outbox and written together when the context exits.
+
+    note: CPython does not expose recvmmsg/sendmmsg, so each datagram
+    still takes a system call, but the poll performed before every read
+    by the base backend is avoided."""
+
+    def __init__(self, socket: skt.socket, bufsize: int = MAX_BUFSIZE):
+        super().__init__(socket, bufsize)
+        self.local = threading.local()
+
+    def recv_batch(self) -> List[Tuple[bytes, Address]]:
+        if not self._wait_readable():
+            return []
+
+        batch = []
+        for _ in range(RECV_BATCH):
+            try:
+                batch.append(self.socket.recvfrom(self.bufsize))
+            except skt.error:
+                break
+
+        return batch
+
+    def send(self, data: bytes, address: Address):
+        outbox = getattr(self.local, "outbox", None)
+        if outbox is not None:
+            outbox.append((data, address))
+            return
+
+        self._sendto(data, address)
+
+    @contextmanager
+    def batch(self):
+        self.local.outbox = []
+        try:
+            yield
+        finally:
+            outbox = self.local.outbox
+            self.local.outbox = None
+            for data, address in outbox:
+                self._sendto(data, address)
+
+
+IO_BACKENDS: Dict[str, Type[DatagramIO]] = {
+    "simple": DatagramIO,
+    "batched": BatchedDatagramIO,
+}
@@ -11,3 +11,8 @@ class SendingNoneData(Exception):
 class InvalidAddress(Exception):
     "Se trató de enviar un stream de bytes con una dirección nula"
     pass
+
+
+class StreamLimitReached(Exception):
+    "Se alcanzó la cantidad máxima de streams y ninguno puede liberarse"
+    pass
@@ -0,0 +1,142 @@
+from collections import OrderedDict, deque
+from threading import Condition, Lock
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from lib.transport.consts import Address
+from lib.transport.transport_packet import Received
+
+PeerFilter = Callable[[Address], bool]
+
+
+class PeerWaiters:
+
+    """
+    Consumers blocked until a specific peer has packets ready."""
+
+    def __init__(self, lock: Lock):
+        self.condition = Condition(lock)
+        self.count = 0
+
+
+class ReceiveQueues:
+
+    """
+    Received packets waiting to be read, with a queue for each peer.
+
+    Packets can be read from a specific peer, or from any peer that has
+    packets ready (optionally, only from the peers accepted by a filter).
+    Packets of other peers are left in their queues, so every consumer
+    gets the packets of the peers it reads from, and only those.
+
+    Peers with packets are kept in order of readiness: reading from any
+    peer takes a packet from the first one, and moves it to the end if
+    it still has packets, so that peers are served in round robin.
+
+    It can be used as the receive queue of the streams of a protocol,
+    since it accepts the same (data, address) items as Queue.put.
+
+    Each packet wakes a single consumer of its peer, if one is waiting.
+    Consumers of any peer are only woken when a peer that had no packets
+    becomes ready, since otherwise they would already have taken it."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.any_ready = Condition(self.lock)
+        self.waiters: Dict[Address, PeerWaiters] = {}
+        self.queues: Dict[Address, Deque[Received]] = {}
+        self.ready: "OrderedDict[Address, None]" = OrderedDict()
+
+    def put(self, item: Tuple[Received, Address]):
+        """
+        Queues a packet received from a peer, given as (data, address)."""
+
+        data, address = item
+
+        with self.lock:
+            queue = self.queues.get(address)
+            if queue is None:
+                queue = self.queues[address] = deque()
+                self.ready[address] = None
+                self.any_ready.notify_all()
+            queue.append(data)
+
+            waiters = self.waiters.get(address)
+            if waiters is not None:
+                waiters.condition.notify()
+
+    def get(self, accept: Optional[PeerFilter] = None) -> Tuple[Received, Address]:
+        """
+        Returns a packet, and its address, from any peer with packets ready
+        (and accepted by the filter, if any). Blocks until there is one."""
+
+        with self.lock:
+            while True:
+                address = self._first_ready(accept)
+                if address is not None:
+                    return self._pop(address), address
+                self.any_ready.wait()
+
+    def get_from(self, address: Address) -> Received:
+        """
+        Returns a packet received from the peer. Blocks until there is one."""
+
+        with self.lock:
+            if address not in self.queues:
+                self._wait_for(address)
+
+            return self._pop(address)
+
+    def ready_peers(self, timeout: Optional[float] = None) -> List[Address]:
+        """
+        Returns the peers with packets ready, in order of readiness. Blocks
+        until there is at least one, or until the timeout (in seconds)
+        expires, in which case the list is empty."""
+
+        with self.lock:
+            self.any_ready.wait_for(lambda: self.ready, timeout)
+            return list(self.ready)
+
+    def _wait_for(self, address: Address):
+        """
+        Blocks until the peer has packets ready. Must be called with the
+        lock held."""
+
+        waiters = self.waiters.get(address)
+        if waiters is None:
+            waiters = self.waiters[address] = PeerWaiters(self.lock)
+
+        waiters.count += 1
+        try:
+            while address not in self.queues:
+                waiters.condition.wait()
+        finally:
+            waiters.count -= 1
+            if waiters.count == 0:
+                del self.waiters[address]
+
+    def _first_ready(self, accept: Optional[PeerFilter]) -> Optional[Address]:
+        """
+        Returns the first peer with packets ready accepted by the filter, or
+        None if there is none. Must be called with the lock held."""
+
+        for address in self.ready:
+            if accept is None or accept(address):
+                return address
+
+        return None
+
+    def _pop(self, address: Address) -> Received:
+        """
+        Takes the first packet of the queue of the peer, which must have
+        one. Must be called with the lock held."""
+
+        queue = self.queues[address]
+        data = queue.popleft()
+
+        if queue:
+            self.ready.move_to_end(address)
+        else:
+            del self.queues[address]
+            del self.ready[address]
+
+        return data
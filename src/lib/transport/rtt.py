@@ -0,0 +1,77 @@
+import time
+from threading import Lock
+from typing import Optional
+
+from lib.transport.consts import MAX_RTO, MIN_RTO, TIMER
+
+
+class RTTEstimator:
+
+    """
+    Estimates the round trip time of a stream and derives its
+    retransmission timeout, following RFC 6298.
+
+    Samples must only be taken from packets that were sent once (Karn's
+    rule), since the acknowledgment of a retransmitted packet cannot be
+    matched to a specific transmission.
+
+    Every attribute can be read at any time for monitoring purposes."""
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    K = 4
+
+    def __init__(
+        self,
+        initial_rto: float = TIMER,
+        min_rto: float = MIN_RTO,
+        max_rto: float = MAX_RTO,
+    ):
+        self.srtt: Optional[float] = None
+        self.rttvar: Optional[float] = None
+        self.rto = initial_rto
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.samples = 0
+        self.backoffs = 0
+        self.last_backoff = 0.0
+
+        self.lock = Lock()
+
+    def sample(self, rtt: float):
+        """
+        Updates the estimation with a new round trip time measurement
+        (in seconds). This also resets any backoff applied to the
+        timeout."""
+
+        with self.lock:
+            if self.srtt is None:
+                self.srtt = rtt
+                self.rttvar = rtt / 2
+            else:
+                self.rttvar += self.BETA * (abs(self.srtt - rtt) - self.rttvar)
+                self.srtt += self.ALPHA * (rtt - self.srtt)
+
+            self.samples += 1
+            self.rto = self._bounded(self.srtt + self.K * self.rttvar)
+
+    def backoff(self, sent_at: float):
+        """
+        Doubles the retransmission timeout. Must be called every time the
+        deadline of a packet sent at the specified time (as given by
+        time.monotonic) expires.
+
+        The timeout is doubled once per timeout event (RFC 6298, 5.5):
+        packets sent before the last backoff expired with the same
+        timeout, so they do not double it again."""
+
+        with self.lock:
+            if sent_at < self.last_backoff:
+                return
+
+            self.last_backoff = time.monotonic()
+            self.backoffs += 1
+            self.rto = self._bounded(self.rto * 2)
+
+    def _bounded(self, rto: float) -> float:
+        return min(max(rto, self.min_rto), self.max_rto)
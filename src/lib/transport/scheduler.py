@@ -0,0 +1,112 @@
+import heapq
+import itertools
+import threading
+import time
+from typing import Any, Callable, List, Tuple
+
+from lib.logger import logger
+
+
+class TimerHandle:
+
+    """
+    A deadline registered in a RetransmissionScheduler.
+
+    Cancelling a handle only marks it, so it is O(1) and never touches
+    a thread. Cancelled handles are discarded by the scheduler when
+    they reach the top of its heap."""
+
+    def __init__(self, deadline: float, callback: Callable, args: Tuple[Any, ...]):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        """
+        Prevents the callback from being executed."""
+
+        self.cancelled = True
+
+
+class RetransmissionScheduler:
+
+    """
+    Schedules deadlines for every stream of a transport protocol using
+    a single thread.
+
+    Deadlines are kept in a heap ordered by expiration time. The service
+    thread sleeps until the earliest deadline expires (or until an
+    earlier one is registered) and then executes its callback."""
+
+    def __init__(self):
+        self.heap: List[Tuple[float, int, TimerHandle]] = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.running = True
+
+        self.thread_handle = threading.Thread(target=self._run)
+        self.thread_handle.daemon = True
+        self.thread_handle.start()
+
+    def schedule(self, delay: float, callback: Callable, *args) -> TimerHandle:
+        """
+        Registers a callback to be executed after the specified delay
+        (in seconds). Returns a handle that can be used to cancel it."""
+
+        handle = TimerHandle(time.monotonic() + delay, callback, args)
+
+        with self.condition:
+            entry = (handle.deadline, next(self.counter), handle)
+            heapq.heappush(self.heap, entry)
+            if self.heap[0] is entry:
+                self.condition.notify()
+
+        return handle
+
+    def _run(self):
+        """
+        Executes the callbacks of the expired deadlines until the
+        scheduler is stopped."""
+
+        while True:
+            handle = self._next_expired()
+            if handle is None:
+                return
+
+            try:
+                handle.callback(*handle.args)
+            except Exception:
+                logger.exception("Error while executing a deadline")
+
+    def _next_expired(self):
+        """
+        Blocks until a deadline expires and returns its handle. Returns
+        None if the scheduler has been stopped."""
+
+        with self.condition:
+            while self.running:
+                while self.heap and self.heap[0][2].cancelled:
+                    heapq.heappop(self.heap)
+
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+
+                remaining = self.heap[0][0] - time.monotonic()
+                if remaining > 0:
+                    self.condition.wait(remaining)
+                    continue
+
+                return heapq.heappop(self.heap)[2]
+
+        return None
+
+    def stop(self):
+        """
+        Stops the service thread. Pending deadlines are discarded."""
+
+        with self.condition:
+            self.running = False
+            self.heap.clear()
+            self.condition.notify()
@@ -0,0 +1,30 @@
+class TransportStats:
+
+    """
+    Counters describing how a stream recovered from losses.
+
+    A loss is recovered quickly when it is detected from the
+    acknowledgments of later packets (fast retransmit), and slowly when
+    the retransmission deadline of the packet had to expire."""
+
+    def __init__(self):
+        self.packets_sent = 0
+        self.fast_retransmits = 0
+        self.timeout_retransmits = 0
+
+    @property
+    def retransmits(self) -> int:
+        return self.fast_retransmits + self.timeout_retransmits
+
+    def __add__(self, other: "TransportStats") -> "TransportStats":
+        total = TransportStats()
+        for name in vars(total):
+            setattr(total, name, getattr(self, name) + getattr(other, name))
+        return total
+
+    def as_dict(self) -> dict:
+        """
+        Returns the counters as a dictionary, including the total
+        amount of retransmissions."""
+
+        return dict(vars(self), retransmits=self.retransmits)
@@ -1,31 +1,58 @@
+import time
 from queue import Queue
-from socket import socket
-from threading import Semaphore, Timer, Lock
-from typing import Dict
-from lib.transport.consts import DROP_THRESHOLD, TIMER, WINDOW_SIZE, Address
+from threading import Condition, Lock
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
+from lib.transport.congestion import CONGESTION_CONTROLLERS
+from lib.transport.datagram_io import DatagramWriter
+from lib.transport.consts import (
+    ACK_DELAY,
+    ACK_EVERY,
+    CONGESTION,
+    DUPLICATE_THRESHOLD,
+    LINGER,
+    RECV_BUFFER,
+    SEQUENCE_BITS,
+    TIMER,
+    WINDOW_SIZE,
+    Address,
+)
+from lib.transport.receive_queues import ReceiveQueues
+from lib.transport.rtt import RTTEstimator
+from lib.transport.scheduler import RetransmissionScheduler, TimerHandle
+from lib.transport.stats import TransportStats
 
 from lib.transport.transport_packet import (
-    SEQUENCE_BYTES,
+    ACK_REQUEST,
+    Payload,
+    Received,
     TransportAckPacket,
     TransportDataPacket,
-    InvalidPacketException,
+    TransportFinAckPacket,
+    TransportFinPacket,
     TransportPacket,
+    TransportSackPacket,
 )
 
 
 class SequenceNumber:
 
     """
-    The sequence numbers are unsigned 16-bit integers, increasing in
-    each sent packet. When reaching the maximum value, it is reset to 0."""
+    The sequence numbers are unsigned integers (16-bit by default),
+    increasing in each sent packet. When reaching the maximum value, it
+    is reset to 0.
 
-    MAX_VALUE: int = SEQUENCE_BYTES**16 - 1
+    Since sequence numbers wrap around, they are compared using serial
+    number arithmetic (RFC 1982): a precedes b if b is less than half
+    of the sequence space ahead of a."""
 
-    def __init__(self):
+    def __init__(self, bits: int = SEQUENCE_BITS):
         self._value = 0
+        self.bits = bits
+        self.modulus = 1 << bits
+        self.max_value = self.modulus - 1
 
     def increase(self):
-        if self._value == self.MAX_VALUE:
+        if self._value == self.max_value:
             self._value = 0
         else:
             self._value += 1
@@ -34,125 +61,463 @@ class SequenceNumber:
     def value(self) -> int:
         return self._value
 
+    @property
+    def bytes(self) -> int:
+        """
+        Amount of bytes needed to encode the sequence numbers."""
+
+        return self.bits // 8
+
+    def precedes(self, a: int, b: int) -> bool:
+        """
+        Returns True if the sequence number a was sent before b."""
+
+        return 0 < (b - a) % self.modulus < self.modulus // 2
+
+    def distance(self, a: int, b: int) -> int:
+        """
+        Amount of sequence numbers from a to b."""
+
+        return (b - a) % self.modulus
+
+    def within(self, sequence: int, start: int, end: int) -> bool:
+        """
+        Returns True if the sequence number is inside the range that
+        starts at start (inclusive) and ends at end (exclusive)."""
+
+        return self.distance(start, sequence) < self.distance(start, end)
+
+    def following(self, sequence: int) -> int:
+        """
+        Returns the sequence number that follows the specified one."""
+
+        return (sequence + 1) % self.modulus
+
+
+class OutstandingPackets:
+
+    """
+    Amount of data packets sent by the streams of a protocol that have
+    not been acknowledged (nor dropped) yet.
+
+    Keeping a single counter lets the protocol know if it still has to
+    read without asking every stream. When the counter drops to zero,
+    on_drained is called, so that whoever waits for it can be woken up."""
+
+    def __init__(self, on_drained: Optional[Callable[[], None]] = None):
+        self.count = 0
+        self.lock = Lock()
+        self.on_drained = on_drained
+
+    def add(self):
+        """
+        Counts a new packet."""
+
+        with self.lock:
+            self.count += 1
+
+    def remove(self):
+        """
+        Discounts a packet that has been acknowledged or dropped."""
+
+        with self.lock:
+            self.count -= 1
+            drained = self.count == 0
+
+        if drained and self.on_drained is not None:
+            self.on_drained()
+
 
 class ReliableStream:
 
     """
     This class implements reliable and ordered data transmission over
-    a UDP socket with a specific recipient.
+    a UDP socket with a specific recipient. Datagrams are written through
+    the I/O of the protocol (any DatagramWriter).
 
     Since the stream does not actively read from the socket, it is necessary
-    to call recv() with the received data from the connection address so that
-    the stream can process it.
-
-    When the stream receives a correct data packet, it is queued in recv_queue.
+    to call handle_packet() with the packets received from the connection
+    address (and session) so that the stream can process them.
+
+    Several streams can exchange packets with the same address if they
+    belong to different sessions. Every packet sent by the stream is
+    tagged with its session.
+
+    When the stream receives a correct data packet, it is queued in recv_queue
+    (a queue of its own, or the per peer queues shared by the protocol).
+    The stream holds at most recv_buffer packets between its out of order
+    buffer and recv_queue, and advertises the space it has left to the
+    sender, which never sends past it. Whoever reads from recv_queue must
+    call consumed() for every packet of the stream it takes.
+
+    Retransmission deadlines are registered in the scheduler shared by
+    every stream of the protocol, instead of starting a thread per packet.
+    The timeout is derived from the round trip times measured by the
+    stream, which can be read from its rtt attribute. The deadlines of the
+    unacked packets are kept in timers, which is only accessed with the
+    window lock held, since the sender, the reader and the scheduler all
+    update it.
+
+    The amount of packets in flight is limited by both the window size
+    and the congestion window of the selected congestion controller.
+
+    Received packets are acknowledged with selective acknowledgements,
+    which are delayed so that a single one covers several packets. The
+    sender uses them to detect lost packets and retransmit them without
+    waiting for their deadline (fast retransmit). How losses were
+    recovered can be read from the stats attribute.
+
+    Packets sent and not yet acknowledged are also counted in the
+    outstanding counter, which may be shared by every stream of the
+    protocol.
+
+    Closing the stream is explicit: once every data packet has been
+    acknowledged, a FIN packet is sent, and the stream is finished when
+    the peer answers with a FIN-ACK. If the peer already sent its own
+    FIN, it is gone, so the stream finishes without sending one. While
+    closing, a peer that stays silent for LINGER seconds is assumed to
+    be gone, and the packets that it did not acknowledge are abandoned.
     """
 
     def __init__(
         self,
-        socket: socket,
+        io: DatagramWriter,
         target: Address,
-        recv_queue: Queue,
+        recv_queue: Union[Queue, ReceiveQueues],
+        scheduler: RetransmissionScheduler,
         window_size: int = WINDOW_SIZE,
+        congestion: str = CONGESTION,
+        sequence_bits: int = SEQUENCE_BITS,
+        recv_buffer: int = RECV_BUFFER,
+        session: int = 0,
+        outstanding: Optional[OutstandingPackets] = None,
     ):
-        self.next_seq = SequenceNumber()
-        self.expected = SequenceNumber()
-        self.buffer: Dict[int, bytes] = {}
-        self.timers: Dict[int, Timer] = {}
-        self.window_semaphore = Semaphore(window_size)
-        self.consecutive_interrupts = 0
+        self.next_seq = SequenceNumber(sequence_bits)
+        self.expected = SequenceNumber(sequence_bits)
+        self.buffer: Dict[int, Received] = {}
+        self.recv_buffer = recv_buffer
+        self.queued = 0
+        self.advertised = recv_buffer
+        self.peer_cumulative = 0
+        self.peer_window = recv_buffer
+        self.timers: Dict[int, TimerHandle] = {}
+        self.send_times: Dict[int, float] = {}
+        self.retransmitted: Set[int] = set()
+        self.fast_retransmitted: Set[int] = set()
+        self.last_cumulative: Optional[int] = None
+        self.duplicate_acks = 0
+        self.stats = TransportStats()
+        self.rtt = RTTEstimator()
+        self.congestion = CONGESTION_CONTROLLERS[congestion](window_size)
+        self.window = Condition()
+        self.in_flight = 0
+        self.recv_lock = Lock()
+        self.pending_acks = 0
+        self.ack_timer: Optional[TimerHandle] = None
+        self.last_heard = time.monotonic()
         self.closing = False
-
-        self.socket_lock = Lock()
-        self.socket = socket
+        self.finished = False
+        self.peer_finished = False
+        self.fin_timer: Optional[TimerHandle] = None
+        self.fin_sent_at = 0.0
+        self.scheduler = scheduler
+        if outstanding is None:
+            outstanding = OutstandingPackets()
+        self.outstanding = outstanding
+
+        self.io = io
         self.target = target
         self.recv_queue = recv_queue
+        self.session = session
 
-    def send(self, data: bytes):
+    def send(self, data: Payload, last: bool = False):
         """
         Sends a data packet to the specified recipient. If the window
-        size is reached, it blocks until an acknowledgment is received"""
+        size is reached, it blocks until an acknowledgment is received.
+        The last packet of a transfer is acknowledged immediately."""
 
-        self.window_semaphore.acquire()
+        window_full = self._acquire_window()
+        self._send_next(data, window_full or last)
 
-        packet = TransportDataPacket(self.next_seq._value, data)
+    def _send_next(self, data: Payload, urgent: bool):
+        """
+        Sends the data in a new packet, once its space in the window has
+        been reserved. If urgent (for example, when the window is now
+        full), an immediate acknowledgment is requested."""
+
+        packet = TransportDataPacket(self.next_seq.value, data, self.next_seq.bytes)
+        if urgent:
+            packet.flags = ACK_REQUEST
+        self.outstanding.add()
         self._send_data_packet(packet)
         self.next_seq.increase()
 
+    def _acquire_window(self) -> bool:
+        """
+        Blocks until a new packet fits in both the congestion window and
+        the window advertised by the recipient, and reserves a space for
+        it. Returns True if the window is now full."""
+
+        with self.window:
+            while (
+                self.in_flight >= self.congestion.window
+                or not self._peer_accepts(self.next_seq.value)
+            ):
+                self.window.wait()
+            self.in_flight += 1
+
+            return self.in_flight >= self.congestion.window
+
+    def _peer_accepts(self, sequence: int) -> bool:
+        """
+        Returns True if the sequence number is inside the window advertised
+        by the recipient. When the advertised window is empty, a single
+        packet is allowed so that the recipient can announce when it has
+        space again."""
+
+        distance = self.next_seq.distance(self.peer_cumulative, sequence)
+        return distance < max(1, self.peer_window)
+
+    def _release_window(self, sequence: int):
+        """
+        Releases the space of an acknowledged packet in the window, and
+        notifies the congestion controller."""
+
+        rtt = self._sample_rtt(sequence)
+
+        with self.window:
+            self.in_flight -= 1
+            self.congestion.on_ack(rtt)
+            self.window.notify()
+
     def _send_data_packet(self, packet: TransportDataPacket):
         """
         Sends the specified DataPacket and starts the corresponding timer."""
 
+        self.send_times[packet.sequence] = time.monotonic()
         self._start_timer_for(packet)
         self._send_packet(packet)
+        self.stats.packets_sent += 1
 
     def _resend_data_packet(self, packet: TransportDataPacket):
         """
-        Resends the specified DataPacket. If the threshold of consecutive
-        interrupts is reached, it is ignored. This allows the stream to
-        stop when the connection is closed by the user."""
+        Resends the specified DataPacket. If the stream is closing and the
+        peer is gone, every unacknowledged packet is abandoned instead."""
+
+        with self.window:
+            handle = self.timers.pop(packet.sequence, None)
+            if handle is None:
+                return
+
+            if self.closing and self._peer_gone():
+                self.outstanding.remove()
+                self._forget(packet.sequence)
+                self._abort()
+                return
+
+            sent_at = self.send_times[packet.sequence]
+            self.congestion.on_timeout(sent_at)
+
+        self.rtt.backoff(sent_at)
+
+        self.stats.timeout_retransmits += 1
+        self._retransmit(packet)
 
-        try:
-            self.timers.pop(packet.sequence).cancel()
-        except KeyError:
+    def _fast_retransmit(self, sequence: int):
+        """
+        Resends the DataPacket with the specified sequence number, which
+        has been detected as lost, without waiting for its deadline. A
+        packet is fast retransmitted at most once; if the retransmission
+        is also lost, its deadline will expire."""
+
+        if sequence in self.fast_retransmitted:
             return
 
+        with self.window:
+            handle = self.timers.pop(sequence, None)
+            if handle is None:
+                return
+            handle.cancel()
+            self.congestion.on_loss(self.send_times[sequence])
+
+        packet = handle.args[0]
 
-        self.consecutive_interrupts += 1
-        if self.consecutive_interrupts >= DROP_THRESHOLD and self.closing:
-            raise ConnectionError("Connection closed by user")
+        self.fast_retransmitted.add(sequence)
+        self.stats.fast_retransmits += 1
+        self._retransmit(packet)
+
+    def _retransmit(self, packet: TransportDataPacket):
+        """
+        Sends the specified DataPacket again, asking for an immediate
+        acknowledgment."""
 
+        self.retransmitted.add(packet.sequence)
+        packet.flags |= ACK_REQUEST
         self._send_data_packet(packet)
 
     def _start_timer_for(self, packet: TransportDataPacket):
         """
-        Starts the timer to resend the specified DataPacket."""
+        Registers the deadline to resend the specified DataPacket."""
 
-        timer = Timer(TIMER, self._resend_data_packet, args=[packet])
-        timer.start()
-        self.timers[packet.sequence] = timer
+        with self.window:
+            self.timers[packet.sequence] = self.scheduler.schedule(
+                self.rtt.rto, self._resend_data_packet, packet
+            )
 
-    def handle_packet(self, data: bytes):
+    def handle_packet(self, packet: TransportPacket):
         """
-        Processes the data received from the connection address.
-        This must be able to be decoded into a Packet, otherwise
-        it is ignored."""
+        Processes a packet received from the connection address, in the
+        session of the stream."""
 
-        try:
-            packet = TransportPacket.decode(data)
-        except InvalidPacketException:
-            return
-
-        self.consecutive_interrupts = 0
+        self.last_heard = time.monotonic()
 
-        if isinstance(packet, TransportAckPacket):
+        if isinstance(packet, TransportSackPacket):
+            self._handle_sack(packet)
+        elif isinstance(packet, TransportAckPacket):
             self._handle_ack(packet)
         elif isinstance(packet, TransportDataPacket):
             self._handle_data(packet)
+        elif isinstance(packet, TransportFinPacket):
+            self._handle_fin(packet)
+        elif isinstance(packet, TransportFinAckPacket):
+            self._handle_fin_ack()
+
+        if self.closing:
+            self._finish()
 
     def _handle_ack(self, packet: TransportAckPacket):
         """
-        Executes when an AckPacket is received. Cancels the timer
-        corresponding to the data packet that has been received and releases
-        a space in the window."""
+        Executes when an AckPacket is received."""
 
-        if self.timers.get(packet.sequence):
-            self.timers.pop(packet.sequence).cancel()
-            self.window_semaphore.release()
+        self._confirm(packet.sequence)
 
-    def _send_packet(self, packet: TransportPacket):
+    def _handle_sack(self, packet: TransportSackPacket):
         """
-        Sends the specified Packet to the specified recipient."""
+        Executes when a SackPacket is received. Confirms every unacked
+        packet that is covered by the cumulative sequence number or by
+        any of the ranges.
+
+        Unacked packets that were followed by at least DUPLICATE_THRESHOLD
+        selectively acknowledged packets are considered lost, as well as
+        the first unacked packet once DUPLICATE_THRESHOLD acknowledgments
+        repeat the same cumulative sequence number."""
+
+        if packet.sequence_bytes != self.next_seq.bytes:
+            return
+
+        self._update_peer_window(packet)
+        highest = self._highest_sacked(packet)
+
+        with self.window:
+            unacked = list(self.timers)
+
+        for sequence in unacked:
+            if self.next_seq.precedes(sequence, packet.cumulative):
+                self._confirm(sequence)
+                continue
 
-        self.socket_lock.acquire()
-        self.socket.sendto(packet.encode(), self.target)
-        self.socket_lock.release()
+            for start, end in packet.ranges:
+                if self.next_seq.within(sequence, start, end):
+                    self._confirm(sequence)
+                    break
+            else:
+                if highest is not None and self._is_lost(sequence, highest):
+                    self._fast_retransmit(sequence)
 
-    def _send_ack(self, sequence: int):
+        self._count_duplicate_ack(packet.cumulative)
+
+    def _update_peer_window(self, packet: TransportSackPacket):
+        """
+        Updates the window advertised by the recipient, unless the
+        packet is older than the last one received."""
+
+        with self.window:
+            if self.next_seq.precedes(packet.cumulative, self.peer_cumulative):
+                return
+
+            self.peer_cumulative = packet.cumulative
+            self.peer_window = packet.window
+            self.window.notify()
+
+    def _highest_sacked(self, packet: TransportSackPacket) -> Optional[int]:
         """
-        Sends an acknowledgment for the packet with the specified sequence"""
+        Returns the highest sequence number that has been selectively
+        acknowledged, or None if there are no ranges."""
+
+        ends = [end for _, end in packet.ranges]
+        if not ends:
+            return None
 
-        self._send_packet(TransportAckPacket(sequence))
+        end = max(ends, key=lambda end: self.next_seq.distance(packet.cumulative, end))
+        return (end - 1) % self.next_seq.modulus
+
+    def _is_lost(self, sequence: int, highest: int) -> bool:
+        """
+        Returns True if the unacked sequence number was sent at least
+        DUPLICATE_THRESHOLD packets before the highest selectively
+        acknowledged sequence number."""
+
+        return (
+            self.next_seq.precedes(sequence, highest)
+            and self.next_seq.distance(sequence, highest) >= DUPLICATE_THRESHOLD
+        )
+
+    def _count_duplicate_ack(self, cumulative: int):
+        """
+        Counts acknowledgments that repeat the cumulative sequence number
+        while it is still unacked, and fast retransmits it when the
+        threshold is reached."""
+
+        with self.window:
+            unacked = cumulative in self.timers
+
+        if cumulative != self.last_cumulative or not unacked:
+            self.last_cumulative = cumulative
+            self.duplicate_acks = 0
+            return
+
+        self.duplicate_acks += 1
+        if self.duplicate_acks == DUPLICATE_THRESHOLD:
+            self._fast_retransmit(cumulative)
+
+    def _confirm(self, sequence: int):
+        """
+        Cancels the deadline corresponding to the data packet that has
+        been received and releases a space in the window.
+
+        The round trip time is only sampled if the packet was not
+        retransmitted (Karn's rule)."""
+
+        with self.window:
+            handle = self.timers.pop(sequence, None)
+
+        if handle is not None:
+            handle.cancel()
+            self.fast_retransmitted.discard(sequence)
+            self._release_window(sequence)
+            self.outstanding.remove()
+
+    def _sample_rtt(self, sequence: int) -> Optional[float]:
+        """
+        Updates the round trip time estimation with the acknowledged
+        packet, unless it has been retransmitted. Returns the measured
+        round trip time, if any."""
+
+        sent_at = self.send_times.pop(sequence)
+        if sequence in self.retransmitted:
+            self.retransmitted.discard(sequence)
+            return None
+
+        rtt = time.monotonic() - sent_at
+        self.rtt.sample(rtt)
+        return rtt
+
+    def _send_packet(self, packet: TransportPacket):
+        """
+        Sends the specified Packet to the specified recipient."""
+
+        packet.session = self.session
+        self.io.send(packet.encode(), self.target)
 
     def _handle_data(self, packet: TransportDataPacket):
         """
@@ -162,44 +527,309 @@ class ReliableStream:
         is saved in the buffer.
 
         When queuing a packet in recv_queue, it is checked if there are packets
-        in the buffer that can also be queued."""
+        in the buffer that can also be queued.
+
+        Only packets inside the receive window are accepted. The width of
+        the sequence numbers is taken from the first packet received."""
 
         if packet.length != len(packet.data):
             return
 
+        with self.recv_lock:
+            if not self._matches_sequence_width(packet):
+                return
 
-        self._send_ack(packet.sequence)
+            filled_gap = len(self.buffer) > 0
+            in_order = packet.sequence == self.expected.value
+            accepted = self._fits_in_window(packet.sequence)
 
-        if packet.sequence == self.expected.value:
-            self.expected.increase()
-            self._queue_packet(packet.data)
-            self._queue_buffered()
-        elif packet.sequence > self.expected.value:
-            self.buffer[packet.sequence] = packet.data
+            if in_order and accepted:
+                self.expected.increase()
+                self._queue_packet(packet.data)
+                self._queue_buffered()
+            elif accepted:
+                self.buffer[packet.sequence] = packet.data
+
+            urgent = packet.flags & ACK_REQUEST
+            self._acknowledge(not in_order or filled_gap or urgent)
 
-    def _queue_packet(self, data: bytes):
+    def _matches_sequence_width(self, packet: TransportDataPacket) -> bool:
+        """
+        Returns True if the packet uses the same sequence number width as
+        the stream. If nothing has been received yet, the stream adopts
+        the width of the packet."""
+
+        if packet.sequence_bytes == self.expected.bytes:
+            return True
+
+        if self.expected.value != 0 or self.buffer:
+            return False
+
+        self.expected = SequenceNumber(packet.sequence_bytes * 8)
+        return True
+
+    def _fits_in_window(self, sequence: int) -> bool:
+        """
+        Returns True if the sequence number is not behind the expected
+        one, and is inside the receive window."""
+
+        expected = self.expected.value
+        if sequence != expected and not self.expected.precedes(expected, sequence):
+            return False
+
+        return self.expected.distance(expected, sequence) < self._receive_window()
+
+    def _receive_window(self) -> int:
+        """
+        Amount of packets, starting from the expected one, that the
+        stream can still hold."""
+
+        return max(0, self.recv_buffer - self.queued)
+
+    def _acknowledge(self, immediate: bool):
+        """
+        Registers a received packet that must be acknowledged. The
+        acknowledgment is delayed until ACK_EVERY packets are pending or
+        ACK_DELAY seconds have passed, unless it must be sent immediately
+        (for example, when packets are received out of order)."""
+
+        self.pending_acks += 1
+
+        if immediate or self.pending_acks >= ACK_EVERY:
+            self._send_sack()
+        elif self.ack_timer is None:
+            self.ack_timer = self.scheduler.schedule(ACK_DELAY, self._delayed_ack)
+
+    def _flush_acks(self):
+        """
+        Sends the pending acknowledgments without waiting for their delay."""
+
+        with self.recv_lock:
+            if self.pending_acks > 0:
+                self._send_sack()
+
+    def _delayed_ack(self):
+        """
+        Sends the pending acknowledgments once the delay has expired."""
+
+        with self.recv_lock:
+            self.ack_timer = None
+            if self.pending_acks > 0:
+                self._send_sack()
+
+    def _send_sack(self):
+        """
+        Sends a selective acknowledgment for every packet received so far."""
+
+        if self.ack_timer is not None:
+            self.ack_timer.cancel()
+            self.ack_timer = None
+        self.pending_acks = 0
+        self.advertised = self._receive_window()
+
+        self._send_packet(
+            TransportSackPacket(
+                self.expected.value,
+                self.advertised,
+                self._sack_ranges(),
+                self.expected.bytes,
+            )
+        )
+
+    def _sack_ranges(self) -> List[Tuple[int, int]]:
+        """
+        Returns the ranges of sequence numbers stored in the buffer,
+        starting with the closest to the expected sequence number."""
+
+        expected = self.expected.value
+        buffered = sorted(
+            self.buffer, key=lambda sequence: self.expected.distance(expected, sequence)
+        )
+
+        ranges: List[Tuple[int, int]] = []
+        for sequence in buffered:
+            if ranges and ranges[-1][1] == sequence:
+                ranges[-1] = (ranges[-1][0], self.expected.following(sequence))
+            else:
+                ranges.append((sequence, self.expected.following(sequence)))
+
+        return ranges
+
+    def _queue_packet(self, data: Received):
         """
         Queues the specified data packet in recv_queue."""
 
+        self.queued += 1
         self.recv_queue.put((data, self.target))
 
     def _queue_buffered(self):
         """
         Enqueue all data packets in the buffer that can be queued in recv_queue."""
 
-        while self.buffer.get(self.expected.value):
+        while self.expected.value in self.buffer:
             self._queue_packet(self.buffer.pop(self.expected.value))
             self.expected.increase()
 
+    def consumed(self):
+        """
+        Frees the space of a packet taken from recv_queue. If the window
+        advertised to the sender was almost closed and it has now reopened,
+        the sender is notified."""
+
+        with self.recv_lock:
+            self.queued -= 1
+
+            threshold = max(1, self.recv_buffer // 2)
+            if self.advertised < threshold <= self._receive_window():
+                self._send_sack()
+
+    def _handle_fin(self, packet: TransportFinPacket):
+        """
+        Executes when the peer announces that it has finished. The FIN is
+        acknowledged every time it is received, since the FIN-ACK may be
+        lost."""
+
+        self.peer_finished = True
+        self._send_packet(TransportFinAckPacket(packet.sequence, packet.sequence_bytes))
+
+    def _handle_fin_ack(self):
+        """
+        Executes when the peer acknowledges the FIN of the stream, which
+        finishes it."""
+
+        with self.window:
+            if self.fin_timer is None:
+                return
+
+            self.fin_timer.cancel()
+            self.fin_timer = None
+            self.outstanding.remove()
+            self._set_finished()
+
+    def _finish(self):
+        """
+        Sends the FIN of a closing stream once every data packet has been
+        acknowledged, or finishes the stream if the peer is already gone.
+
+        Pending acknowledgments are sent first: once the stream finishes,
+        the scheduler may be stopped before their delay expires, and the
+        peer would retransmit the packets they acknowledge."""
+
+        self._flush_acks()
+
+        with self.window:
+            if self.finished or self.fin_timer is not None or self.timers:
+                return
+
+            if self.peer_finished:
+                self._set_finished()
+                return
+
+            self.outstanding.add()
+            self._send_fin()
+
+    def _send_fin(self):
+        """
+        Sends a FIN and registers the deadline to resend it. Must be
+        called with the window lock held."""
+
+        self.fin_sent_at = time.monotonic()
+        self.fin_timer = self.scheduler.schedule(self.rtt.rto, self._resend_fin)
+        self._send_packet(TransportFinPacket(self.next_seq.value, self.next_seq.bytes))
+
+    def _resend_fin(self):
+        """
+        Resends the FIN whose acknowledgment did not arrive in time, or
+        abandons it if the peer is gone."""
+
+        with self.window:
+            if self.fin_timer is None:
+                return
+
+            if self._peer_gone():
+                self._abort()
+                return
+
+            self.rtt.backoff(self.fin_sent_at)
+            self._send_fin()
+
+    def _peer_gone(self) -> bool:
+        """
+        Returns True if nothing has been received from the peer for
+        LINGER seconds."""
+
+        return time.monotonic() - self.last_heard >= LINGER
+
+    def _abort(self):
+        """
+        Abandons every packet without acknowledgment (including the FIN)
+        and finishes the stream. Must be called with the window lock held."""
+
+        for sequence, handle in self.timers.items():
+            handle.cancel()
+            self.outstanding.remove()
+            self._forget(sequence)
+        self.timers.clear()
+
+        if self.fin_timer is not None:
+            self.fin_timer.cancel()
+            self.fin_timer = None
+            self.outstanding.remove()
+
+        self._set_finished()
+
+    def _forget(self, sequence: int):
+        """
+        Forgets the send time and retransmissions of an abandoned packet,
+        whose timer has been dropped. Must be called with the window lock
+        held."""
+
+        self.send_times.pop(sequence, None)
+        self.retransmitted.discard(sequence)
+        self.fast_retransmitted.discard(sequence)
+
+    def _set_finished(self):
+        """
+        Marks the stream as finished, waking up whoever drains it. Must be
+        called with the window lock held."""
+
+        self.finished = True
+        self.window.notify()
+
+    def drain(self):
+        """
+        Blocks until every sent packet has been acknowledged (or
+        abandoned because the peer stopped answering while closing)."""
+
+        with self.window:
+            while self.has_unacked_packets():
+                self.window.wait(TIMER)
+
+    def is_idle(self) -> bool:
+        """
+        Returns True if the stream holds no state that would be lost by
+        releasing it: no packets without acknowledgment, no received
+        packets waiting to be read, and no pending acknowledgments."""
+
+        return (
+            not self.has_unacked_packets()
+            and not self.buffer
+            and self.queued == 0
+            and self.pending_acks == 0
+        )
+
     def has_unacked_packets(self) -> bool:
         """
-        Returns True if there are packets without acknowledgment."""
+        Returns True if there are packets without acknowledgment,
+        including the FIN."""
 
-        return len(self.timers) > 0
+        with self.window:
+            return len(self.timers) > 0 or self.fin_timer is not None
 
     def close(self):
         """
-        Prepares the stream to close. This implies canceling timers in
-        case it is detected that the recipient has closed the connection."""
+        Starts closing the stream: the FIN is sent as soon as every data
+        packet has been acknowledged (see drain to wait for it)."""
 
         self.closing = True
+        self._finish()
@@ -0,0 +1,256 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Dict, Hashable, List, Optional, Set
+
+from lib.transport.consts import LINGER, MAX_STREAMS, STREAM_IDLE_TIMEOUT
+from lib.transport.exceptions import StreamLimitReached
+from lib.transport.stats import TransportStats
+from lib.transport.stream import ReliableStream
+
+
+class StreamTableStats:
+
+    """
+    Counters describing the streams of a table."""
+
+    def __init__(self):
+        self.creations = 0
+        self.evictions = 0
+        self.live = 0
+
+    def as_dict(self) -> dict:
+        """
+        Returns the counters as a dictionary."""
+
+        return dict(vars(self))
+
+
+class StreamTable:
+
+    """
+    Streams of a protocol, by key (address and session).
+
+    Streams are created on the first lookup of their key that misses.
+    The table keeps them in order of use, so that the least recently
+    used stream is found first.
+
+    A stream is evicted when it has been idle for idle_timeout seconds,
+    or when the table holds max_streams streams and a new one is needed.
+    Only streams that hold no state (see ReliableStream.is_idle) are
+    evicted, and pinned streams never are: they belong to an open
+    session, and are released with pop. If every stream is in use, a new
+    stream can not be created.
+
+    Evicting a stream forgets its sequence numbers, so a peer that stays
+    silent for longer than idle_timeout and then continues its stream is
+    no longer understood. Eviction is lazy: it happens while creating
+    streams, which is the only way the table grows, and when a stream is
+    released because its peer has finished.
+
+    The keys of the streams released because their peer finished are
+    remembered for release_grace seconds (see was_released). A late
+    duplicate of a packet of such a stream must be dropped instead of
+    creating a new stream: out of order data would be buffered by it
+    forever, so it would never be idle.
+
+    The loss recovery counters of the streams that leave the table are
+    kept, so that the totals of the protocol do not decrease."""
+
+    def __init__(
+        self,
+        max_streams: int = MAX_STREAMS,
+        idle_timeout: float = STREAM_IDLE_TIMEOUT,
+        release_grace: float = LINGER,
+    ):
+        self.max_streams = max_streams
+        self.idle_timeout = idle_timeout
+        self.release_grace = release_grace
+
+        self.lock = Lock()
+        self.streams: "OrderedDict[Hashable, ReliableStream]" = OrderedDict()
+        self.last_used: Dict[Hashable, float] = {}
+        self.pinned: Set[Hashable] = set()
+        self.released: "OrderedDict[Hashable, float]" = OrderedDict()
+        self.retired = TransportStats()
+        self.stats = StreamTableStats()
+
+    def get(self, key: Hashable) -> Optional[ReliableStream]:
+        """
+        Returns the stream of the key, marking it as recently used, or
+        None if there is none."""
+
+        with self.lock:
+            stream = self.streams.get(key)
+            if stream is not None:
+                self._touch(key)
+
+            return stream
+
+    def get_or_create(
+        self,
+        key: Hashable,
+        factory: Callable[[], ReliableStream],
+        pinned: bool = False,
+    ) -> ReliableStream:
+        """
+        Returns the stream of the key, creating it with the factory if
+        there is none. Raises StreamLimitReached if the table is full and
+        no stream can be evicted."""
+
+        with self.lock:
+            stream = self.streams.get(key)
+            if stream is None:
+                stream = self._create(key, factory)
+            else:
+                self._touch(key)
+
+            if pinned:
+                self.pinned.add(key)
+
+            return stream
+
+    def pop(self, key: Hashable) -> Optional[ReliableStream]:
+        """
+        Removes the stream of the key from the table, and returns it."""
+
+        with self.lock:
+            if key not in self.streams:
+                return None
+
+            return self._remove(key)
+
+    def release(self, key: Hashable):
+        """
+        Evicts the stream of the key right away, if it can be evicted.
+        Used for streams whose peer has finished."""
+
+        with self.lock:
+            if key in self.streams and self._evictable(key):
+                self._evict(key)
+
+                now = time.monotonic()
+                self._forget_released(now)
+                self.released[key] = now
+
+    def was_released(self, key: Hashable) -> bool:
+        """
+        Returns True if the stream of the key was released because its
+        peer finished less than release_grace seconds ago."""
+
+        with self.lock:
+            self._forget_released(time.monotonic())
+            return key in self.released
+
+    def values(self) -> List[ReliableStream]:
+        """
+        Returns the streams of the table."""
+
+        with self.lock:
+            return list(self.streams.values())
+
+    def transport_stats(self) -> TransportStats:
+        """
+        Returns the aggregated loss recovery counters of every stream
+        that has been in the table."""
+
+        return sum((stream.stats for stream in self.values()), self.retired)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.streams
+
+    def __len__(self) -> int:
+        return len(self.streams)
+
+    def _create(
+        self, key: Hashable, factory: Callable[[], ReliableStream]
+    ) -> ReliableStream:
+        """
+        Creates the stream of the key, evicting streams first to make
+        room for it. Must be called with the lock held."""
+
+        now = time.monotonic()
+        self._evict_idle(now)
+        if len(self.streams) >= self.max_streams:
+            self._evict_least_recently_used()
+
+        stream = factory()
+        self.streams[key] = stream
+        self.released.pop(key, None)
+        self.last_used[key] = now
+        self.stats.creations += 1
+        self.stats.live = len(self.streams)
+
+        return stream
+
+    def _forget_released(self, now: float):
+        """
+        Forgets the streams released more than release_grace seconds ago.
+        Must be called with the lock held."""
+
+        while self.released:
+            key, released_at = next(iter(self.released.items()))
+            if now - released_at < self.release_grace:
+                break
+            del self.released[key]
+
+    def _touch(self, key: Hashable):
+        """
+        Marks the stream of the key as recently used. Must be called
+        with the lock held."""
+
+        self.streams.move_to_end(key)
+        self.last_used[key] = time.monotonic()
+
+    def _evict_idle(self, now: float):
+        """
+        Evicts the streams that have been idle for longer than the idle
+        timeout. Must be called with the lock held."""
+
+        expired = []
+        for key in self.streams:
+            if now - self.last_used[key] < self.idle_timeout:
+                break
+            if self._evictable(key):
+                expired.append(key)
+
+        for key in expired:
+            self._evict(key)
+
+    def _evict_least_recently_used(self):
+        """
+        Evicts the least recently used stream that can be evicted. Must
+        be called with the lock held."""
+
+        for key in self.streams:
+            if self._evictable(key):
+                self._evict(key)
+                return
+
+        raise StreamLimitReached()
+
+    def _evictable(self, key: Hashable) -> bool:
+        """
+        Returns True if the stream of the key can be evicted."""
+
+        return key not in self.pinned and self.streams[key].is_idle()
+
+    def _evict(self, key: Hashable):
+        """
+        Evicts the stream of the key. Must be called with the lock held."""
+
+        self._remove(key)
+        self.stats.evictions += 1
+
+    def _remove(self, key: Hashable) -> ReliableStream:
+        """
+        Removes the stream of the key, keeping its counters. Must be
+        called with the lock held."""
+
+        stream = self.streams.pop(key)
+        del self.last_used[key]
+        self.pinned.discard(key)
+        self.retired = self.retired + stream.stats
+        self.stats.live = len(self.streams)
+
+        return stream
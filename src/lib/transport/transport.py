@@ -1,12 +1,38 @@
 from queue import Queue
 
 import threading
-from typing import Tuple, Dict
+from typing import List, Optional, Tuple
 import socket as skt
-from lib.transport.consts import BUFSIZE, WINDOW_SIZE, Address
-from lib.transport.exceptions import SendingNoneData, InvalidAddress
-
-from lib.transport.stream import ReliableStream
+from lib.transport.consts import (
+    CONGESTION,
+    IO_BACKEND,
+    MAX_STREAMS,
+    RECV_BUFFER,
+    SEQUENCE_BITS,
+    STREAM_IDLE_TIMEOUT,
+    WINDOW_SIZE,
+    Address,
+)
+from lib.transport.datagram_io import IO_BACKENDS
+from lib.transport.exceptions import (
+    InvalidAddress,
+    InvalidPacketException,
+    SendingNoneData,
+    StreamLimitReached,
+)
+from lib.transport.receive_queues import PeerFilter, ReceiveQueues
+from lib.transport.scheduler import RetransmissionScheduler
+from lib.transport.stats import TransportStats
+
+from lib.transport.stream import OutstandingPackets, ReliableStream
+from lib.transport.stream_table import StreamTable
+from lib.transport.transport_packet import (
+    Payload,
+    Received,
+    TransportFinAckPacket,
+    TransportFinPacket,
+    TransportPacket,
+)
 
 
 class ReliableTransportProtocol:
@@ -17,29 +43,108 @@ class ReliableTransportProtocol:
 
     The implementation is connectionless, so the recipient of each
     packet must be explicitly specified. In addition, each received
-    packet includes the address of the sender."""
-
-    def __init__(self, window_size: int = WINDOW_SIZE):
+    packet includes the address of the sender.
+
+    The congestion control algorithm used by every stream can be selected
+    by name (see CONGESTION_CONTROLLERS). Sent packets use sequence numbers
+    of sequence_bits bits (16 or 32).
+
+    Each stream holds at most recv_buffer received packets that have not
+    been read with recv_from, which bounds the memory per connection.
+
+    Datagrams are read and written through the selected I/O backend
+    (see IO_BACKENDS).
+
+    Packets are exchanged in session 0 unless a session is opened with
+    open_session. Each session is a separate stream with its own receive
+    queue, so many transfers with the same (or different) addresses can
+    share the socket and its reader thread.
+
+    Streams are kept in a StreamTable, which holds at most max_streams
+    of them and releases those idle for stream_idle_timeout seconds.
+    Packets that would need a new stream while the table is full of
+    streams in use are dropped.
+
+    Packets received in session 0 are kept in a queue for each peer (see
+    ReceiveQueues). They can be read from a specific peer (recv_from_peer)
+    or from any peer (recv_from), and ready_peers tells which peers have
+    packets ready, like select. Packets of a peer are never discarded
+    because another one is being read."""
+
+    def __init__(
+        self,
+        window_size: int = WINDOW_SIZE,
+        congestion: str = CONGESTION,
+        sequence_bits: int = SEQUENCE_BITS,
+        recv_buffer: int = RECV_BUFFER,
+        io_backend: str = IO_BACKEND,
+        max_streams: int = MAX_STREAMS,
+        stream_idle_timeout: float = STREAM_IDLE_TIMEOUT,
+    ):
         self.socket = skt.socket(skt.AF_INET, skt.SOCK_DGRAM)
+        self.io = IO_BACKENDS[io_backend](self.socket)
         self.window_size = window_size
-
-        self.recv_queue = Queue()
-        self.streams: Dict[Address, ReliableStream] = {}
+        self.congestion = congestion
+        self.sequence_bits = sequence_bits
+        self.recv_buffer = recv_buffer
+
+        self.recv_queue = ReceiveQueues()
+        self.streams = StreamTable(max_streams, stream_idle_timeout)
+        self.scheduler = RetransmissionScheduler()
+        self.outstanding = OutstandingPackets(self._on_drained)
         self.online = True
 
-
         self._spawn_reader()
 
-    def recv_from(self) -> Tuple[bytes, Address]:
+    def recv_from(
+        self, accept: Optional[PeerFilter] = None
+    ) -> Tuple[Received, Address]:
         """
-        Receives a data packet from any source. If no packets have been
-        received yet, it blocks until one is received."""
+        Receives a data packet from any source (accepted by the filter, if
+        given). If no packets have been received yet, it blocks until one
+        is received. The data is a view of the received datagram."""
 
-        return self.recv_queue.get()
+        data, address = self.recv_queue.get(accept)
+        self._consumed(address)
 
-    def send_to(self, data: bytes, target: Address):
-        """Sends a data packet to the specified recipient. If no packets
-        have been received yet, it blocks until one is received."""
+        return data, address
+
+    def recv_from_peer(self, address: Address) -> Received:
+        """
+        Receives a data packet from the specified source. If no packets
+        have been received from it yet, it blocks until one is received.
+        The data is a view of the received datagram."""
+
+        data = self.recv_queue.get_from(address)
+        self._consumed(address)
+
+        return data
+
+    def ready_peers(self, timeout: Optional[float] = None) -> List[Address]:
+        """
+        Returns the sources with data packets ready to be received. If
+        there are none, it blocks until there is one or the timeout (in
+        seconds) expires, in which case the list is empty."""
+
+        return self.recv_queue.ready_peers(timeout)
+
+    def _consumed(self, address: Address):
+        """
+        Frees the space of a packet received from the source in its stream,
+        releasing the stream if the source has finished and nothing is left."""
+
+        stream = self.streams.get((address, 0))
+        if stream is not None:
+            stream.consumed()
+            if stream.peer_finished:
+                self.streams.release((address, 0))
+
+    def send_to(
+        self, data: Payload, target: Address, session: int = 0, last: bool = False
+    ):
+        """Sends a data packet to the specified recipient, in the specified
+        session. If the window is full, it blocks until there is space.
+        The last packet of a transfer is acknowledged immediately."""
 
         if data is None:
             raise SendingNoneData()
@@ -48,7 +153,37 @@ class ReliableTransportProtocol:
             raise InvalidAddress()
 
 
-        self._stream_for_address(target).send(data)
+        self._stream_for_address(target, session).send(data, last)
+
+    def open_session(
+        self, target: Address, session: int
+    ) -> "ReliableTransportSession":
+        """
+        Returns an object to exchange packets with the recipient in the
+        specified session. Packets of a session other than 0 are dropped
+        until it is opened."""
+
+        return ReliableTransportSession(self, target, session)
+
+    def has_session(self, target: Address, session: int) -> bool:
+        """
+        Returns True if the session with the recipient is open."""
+
+        return (target, session) in self.streams
+
+    def close_session(self, target: Address, session: int):
+        """
+        Waits for the packets sent in the session to be confirmed, and then
+        releases its stream. The stream of session 0 is never released."""
+
+        stream = self.streams.get((target, session))
+        if stream is None:
+            return
+
+        stream.close()
+        stream.drain()
+        if session != 0:
+            self.streams.pop((target, session))
 
     def _spawn_reader(self):
         """
@@ -61,32 +196,99 @@ class ReliableTransportProtocol:
 
     def _reader(self):
         """
-        Reads continuously from the socket and processes the received"""
+        Reads continuously from the socket and processes the received
+        packets. The acknowledgments generated while handling a batch of
+        packets are sent together.
 
-        socket = self.socket.dup()
-        socket.settimeout(1)
-        while self.online or self._has_unacked_packets():
-            try:
-                data, address = socket.recvfrom(BUFSIZE)
-            except skt.error:
-                continue
+        Once the protocol is closed, it keeps reading until every sent
+        packet has been acknowledged (or abandoned). The reader blocks
+        until a datagram arrives, and is woken up when it must check
+        whether to stop.
 
-            self._stream_for_address(address).handle_packet(data)
+        Streams whose peer has finished are released as soon as they
+        hold no state."""
 
-    def _stream_for_address(self, address):
+        while self.online or self._has_unacked_packets():
+            with self.io.batch():
+                for data, address in self.io.recv_batch():
+                    try:
+                        packet = TransportPacket.decode(data)
+                    except InvalidPacketException:
+                        continue
+
+                    key = (address, packet.session)
+                    stream = self.streams.get(key)
+                    if stream is None:
+                        stream = self._stream_for_packet(packet, address)
+                        if stream is None:
+                            continue
+
+                    stream.handle_packet(packet)
+                    if stream.peer_finished:
+                        self.streams.release(key)
+
+    def _stream_for_packet(
+        self, packet: TransportPacket, address: Address
+    ) -> Optional[ReliableStream]:
+        """
+        Returns the stream for a packet from an address and session that
+        have none, or None if the packet must be dropped. Streams are only
+        created for packets of session 0, since other sessions must be
+        opened first.
+
+        A FIN without stream belongs to a stream already released (its
+        FIN-ACK was lost), so it is acknowledged without creating one. Any
+        other packet of a stream released shortly before is a late
+        duplicate, and is dropped."""
+
+        if isinstance(packet, TransportFinPacket):
+            answer = TransportFinAckPacket(packet.sequence, packet.sequence_bytes)
+            answer.session = packet.session
+            self.io.send(answer.encode(), address)
+            return None
+
+        if packet.session != 0 or self.streams.was_released((address, 0)):
+            return None
+
+        try:
+            return self._stream_for_address(address)
+        except StreamLimitReached:
+            return None
+
+    def _stream_for_address(self, address: Address, session: int = 0) -> ReliableStream:
         """
         Each specific connection is handled by a ReliableStream object.
         This function returns the stream corresponding to the specified
-        address. If it does not exist, a new one is created.
-
-        note: Since there is no handshake, it is vulnerable to syn flood"""
-
-        return self.streams.setdefault(
-            address,
-            ReliableStream(
-                self.socket.dup(), address, self.recv_queue, self.window_size
-            ),
-        )
+        address and session. If it does not exist, a new one is created
+        (raising StreamLimitReached if the table is full).
+
+        Streams of session 0 queue the received data in recv_queue, while
+        every other session has a queue of its own. Streams of sessions
+        other than 0 are pinned to the table until the session is closed.
+
+        note: Since there is no handshake, it is vulnerable to syn flood
+        (bounded by the size of the stream table)"""
+
+        stream = self.streams.get((address, session))
+        if stream is not None:
+            return stream
+
+        def create() -> ReliableStream:
+            recv_queue = self.recv_queue if session == 0 else Queue()
+            return ReliableStream(
+                self.io,
+                address,
+                recv_queue,
+                self.scheduler,
+                self.window_size,
+                self.congestion,
+                self.sequence_bits,
+                self.recv_buffer,
+                session,
+                self.outstanding,
+            )
+
+        return self.streams.get_or_create((address, session), create, session != 0)
 
     def bind(self, address: Address):
         """
@@ -94,33 +296,58 @@ class ReliableTransportProtocol:
 
         self.socket.bind(address)
 
-    def _has_unacked_packets(self):
+    def _has_unacked_packets(self) -> bool:
         """
         Returns True if there is any unconfirmed packet."""
 
-        return any(
-            map(lambda stream: stream.has_unacked_packets(), self.streams.values())
-        )
+        return self.outstanding.count > 0
 
-    def close(self):
+    def _on_drained(self):
         """
-        Closes the socket, releasing the resources associated with it.
+        Wakes up the reader once every sent packet has been confirmed,
+        so that it stops as soon as the protocol is closed."""
 
-        Before closing the socket, waits for all sent packets to be
-        confirmed. If a large number of consecutive timeouts occur
-        without receiving any packets from the recipient, it is assumed
-        that the connection has been lost and the socket is closed. This
-        prevents it from waiting indefinitely for a packet that will
-        never arrive, but it means that the last sent packets may be
-        lost."""
+        if not self.online:
+            self.io.wakeup()
 
-        self.online = False
+    def discard_session(self, target: Address, session: int):
+        """
+        Releases the stream of a session in which nothing has been
+        exchanged, such as a session proposed to the recipient and not
+        accepted. Unlike close_session, no FIN is sent."""
 
+        self.streams.pop((target, session))
+
+    def stats(self) -> TransportStats:
+        """
+        Returns the aggregated loss recovery counters of every stream."""
+
+        return self.streams.transport_stats()
+
+    def close(self):
+        """
+        Closes the socket, releasing the resources associated with it.
+
+        Before closing the socket, every stream is closed: it waits for
+        its sent packets to be confirmed, and then exchanges a FIN and a
+        FIN-ACK with its peer, which usually takes a single round trip.
+        If nothing is received from a peer for LINGER seconds, it is
+        assumed that the connection has been lost and its packets are
+        abandoned. This prevents it from waiting indefinitely for a
+        packet that will never arrive, but it means that the last sent
+        packets may be lost."""
+
+        # The FINs must be counted as outstanding before the reader can see
+        # the protocol offline, or it could stop before their FIN-ACKs.
         for stream in self.streams.values():
             stream.close()
 
+        self.online = False
+        self.io.wakeup()
         self.thread_handle.join()
+        self.scheduler.stop()
 
+        self.io.close()
         self.socket.close()
 
 
@@ -131,33 +358,30 @@ class ReliableTransportClient(ReliableTransportProtocol):
     of the class for the case of a client.
 
     Instead of having to specify the recipient of each packet, you can
-    send and receive data directly (ignoring those packets that do not
-    come from the specified recipient)."""
+    send and receive data directly (reading only the packets that come
+    from the specified recipient)."""
 
-    def __init__(self, target: Address):
+    def __init__(self, target: Address, congestion: str = CONGESTION):
         if target[0] is None or target[1] is None:
             raise InvalidAddress()
 
-        super().__init__()
+        super().__init__(congestion=congestion)
         self.target = target
 
-    def send(self, data: bytes):
+    def send(self, data: Payload, last: bool = False):
         """
         Sends a data packet to the specified recipient."""
 
-        self.send_to(data, self.target)
+        self.send_to(data, self.target, last=last)
 
-    def recv(self) -> bytes:
+    def recv(self) -> Received:
         """
         Receives a data packet from the specified recipient. If no
         packets have been received yet, it blocks until one is
-        received."""
+        received. Packets of other sources are kept for recv_from.
+        The data is a view of the received datagram."""
 
-        data, source = self.recv_from()
-        if source == self.target:
-            return data
-
-        return self.recv()
+        return self.recv_from_peer(self.target)
 
     def set_target(self, target: Address):
         """
@@ -171,12 +395,76 @@ class ReliableTransportServer(ReliableTransportProtocol):
     """
     Implementation of ReliableTransportProtocol that simplifies the use
     of the protocol for server process. It binds to a specific
-    address when it is constructed."""
+    address when it is constructed.
+
+    With reuse_port, several servers (usually in different processes)
+    can bind to the same address. The kernel hashes the address of each
+    client to always deliver its packets to the same server, so every
+    stream is handled by exactly one of them."""
 
-    def __init__(self, address: Address):
+    def __init__(
+        self, address: Address, congestion: str = CONGESTION, reuse_port: bool = False
+    ):
         if address[0] is None or address[1] is None:
             raise InvalidAddress()
 
-        super().__init__()
+        super().__init__(congestion=congestion)
 
+        if reuse_port:
+            self.socket.setsockopt(skt.SOL_SOCKET, skt.SO_REUSEPORT, 1)
         self.bind(address)
+
+
+class ReliableTransportSession:
+
+    """
+    A session multiplexed over the socket of a ReliableTransportProtocol.
+
+    It has the same interface as ReliableTransportClient, but packets are
+    exchanged with the target in the specified session, and received
+    packets are read from the queue of the session. Opening a session
+    does not create any socket or thread."""
+
+    def __init__(
+        self, protocol: ReliableTransportProtocol, target: Address, session: int
+    ):
+        self.protocol = protocol
+        self.target = target
+        self.session = session
+        self.stream = protocol._stream_for_address(target, session)
+
+    def send(self, data: Payload, last: bool = False):
+        """
+        Sends a data packet to the target of the session."""
+
+        self.protocol.send_to(data, self.target, self.session, last)
+
+    def send_to(self, data: Payload, target: Address):
+        """
+        Sends a data packet to the specified recipient, in the session."""
+
+        self.protocol.send_to(data, target, self.session)
+
+    def recv(self) -> Received:
+        """
+        Receives a data packet of the session. If no packets have been
+        received yet, it blocks until one is received. The data is a view
+        of the received datagram."""
+
+        data, _ = self.stream.recv_queue.get()
+        self.stream.consumed()
+
+        return data
+
+    def stats(self) -> TransportStats:
+        """
+        Returns the loss recovery counters of the session."""
+
+        return self.stream.stats
+
+    def close(self):
+        """
+        Closes the session once every sent packet has been confirmed. The
+        socket of the protocol is not closed."""
+
+        self.protocol.close_session(self.target, self.session)
@@ -1,12 +1,67 @@
+import struct
 from abc import ABC
 from enum import IntEnum, auto
+from typing import Callable, Dict, List, Tuple, Union
 
 from lib.transport.exceptions import InvalidPacketException
 
 
 SEQUENCE_BYTES = 2
+WIDE_SEQUENCE_BYTES = 4
 LENGTH_BYTES = 2
-ENDIAN = "big"
+WINDOW_BYTES = 2
+SESSION_BYTES = 4
+
+# Largest header of a data packet, using a session and wide sequence numbers.
+DATA_HEADER_SIZE = 2 + SESSION_BYTES + WIDE_SEQUENCE_BYTES + LENGTH_BYTES
+
+MAX_SACK_RANGES = 16
+
+# Payload of a data packet: a single buffer, or several buffers (such as a
+# header and the data it describes) that are joined when it is encoded.
+Payload = Union[bytes, memoryview, Tuple[bytes, ...]]
+# Payload of a received data packet: a memoryview of the datagram it was
+# received in (which it keeps alive), or bytes. Whoever keeps it for long
+# can copy it with bytes().
+Received = Union[bytes, memoryview]
+
+FLAGS_SHIFT = 8
+OPCODE_MASK = (1 << FLAGS_SHIFT) - 1
+
+# Asks the receiver to acknowledge the packet immediately, instead of
+# delaying the acknowledgment.
+ACK_REQUEST = 0x01
+# Sequence numbers of the packet are encoded with WIDE_SEQUENCE_BYTES.
+WIDE_SEQUENCE = 0x02
+# The header is followed by the identifier of the session of the packet.
+SESSION = 0x04
+
+# Flags and operation code, followed by the session if there is one.
+HEADER = struct.Struct(">H")
+SESSION_HEADER = struct.Struct(">HI")
+
+SEQUENCE_FORMATS = {SEQUENCE_BYTES: "H", WIDE_SEQUENCE_BYTES: "I"}
+
+
+def _structs(fields: str, prefix: str = "") -> Dict[int, struct.Struct]:
+    """
+    Builds the struct of a header for each width of the sequence
+    numbers. Sequence numbers are represented with "S"."""
+
+    return {
+        size: struct.Struct(">" + prefix + fields.replace("S", format))
+        for size, format in SEQUENCE_FORMATS.items()
+    }
+
+
+# Headers of each packet, with and without a session.
+ACK_HEADER = _structs("S", "H")
+DATA_HEADER = _structs("SH", "H")
+SACK_HEADER = _structs("SHB", "H")
+ACK_SESSION_HEADER = _structs("S", "HI")
+DATA_SESSION_HEADER = _structs("SH", "HI")
+SACK_SESSION_HEADER = _structs("SHB", "HI")
+SACK_RANGE = _structs("SS")
 
 
 class _CODES(IntEnum):
@@ -16,26 +71,90 @@ class _CODES(IntEnum):
 
     ACK = auto()
     DATA = auto()
+    SACK = auto()
+    FIN = auto()
+    FIN_ACK = auto()
 
 
 class TransportPacket(ABC):
     """
-    Base class for all transport packets."""
+    Base class for all transport packets.
+
+    The first byte of the header holds the flags of the packet, and the
+    second one its operation code.
+
+    Sequence numbers are encoded with SEQUENCE_BYTES, unless the packet
+    uses wide sequence numbers (signaled by the WIDE_SEQUENCE flag).
+
+    Packets of a session other than 0 carry its identifier right after
+    the operation code (signaled by the SESSION flag), so that several
+    transfers can share the same pair of addresses.
+
+    Headers are packed and unpacked with precompiled structs. Packets
+    are decoded from a memoryview of the received datagram, so the
+    payload of a data packet is never copied, and it is copied only once
+    when the packet is encoded.
+
+    Subclasses are registered in a table of decoders by operation code
+    when they are created, so decoding a packet takes a single lookup.
+    Subclasses without an operation code of their own are not."""
+
+    __slots__ = ("flags", "sequence_bytes", "session")
+
+    _decoders: Dict[int, Callable[..., "TransportPacket"]] = {}
+    _code: int = 0
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        code = cls._opcode()
+        if code == 0:
+            return
+        if code in TransportPacket._decoders:
+            raise ValueError(f"duplicated operation code: {code}")
+
+        cls._code = code
+        TransportPacket._decoders[code] = cls.decode
+
+    def __init__(self, sequence_bytes: int = SEQUENCE_BYTES):
+        self.flags = 0
+        self.sequence_bytes = sequence_bytes
+        self.session = 0
 
     @classmethod
     def decode(cls, data: bytes) -> "TransportPacket":
         """
         Decodes a packet from a byte stream. The packet instance will
-        depend on the operation code."""
+        depend on the operation code. Subclasses decode the whole packet,
+        including the header."""
+
+        view = memoryview(data)
+        try:
+            (header,) = HEADER.unpack_from(view)
+        except struct.error:
+            raise InvalidPacketException()
+
+        opcode = header & OPCODE_MASK
+        flags = header >> FLAGS_SHIFT
+
+        sequence_bytes = SEQUENCE_BYTES
+        if flags & WIDE_SEQUENCE:
+            sequence_bytes = WIDE_SEQUENCE_BYTES
+        session = bool(flags & SESSION)
+
+        decoder = TransportPacket._decoders.get(opcode)
+        if decoder is None:
+            raise InvalidPacketException()
+
+        try:
+            packet = decoder(view, sequence_bytes, session)
+            if session:
+                _, packet.session = SESSION_HEADER.unpack_from(view)
+        except struct.error:
+            raise InvalidPacketException()
+        packet.flags = flags & ~(WIDE_SEQUENCE | SESSION)
 
-        opcode = int.from_bytes(data[:2], ENDIAN)
-        data = data[2:]
-
-        for subclass in cls.__subclasses__():
-            if subclass._opcode() == opcode:
-                return subclass.decode(data)
-
-        raise InvalidPacketException()
+        return packet
 
     @classmethod
     def _opcode(cls) -> int:
@@ -47,68 +166,228 @@ class TransportPacket(ABC):
         """
         Encodes the packet to a byte stream. The byte stream begins
         with the operation code and then the headers specific to each
-        subclass. The base implementation only encodes the operation
-        code."""
+        subclass. The base implementation only encodes the flags and
+        the operation code."""
 
-        return self._opcode().to_bytes(2, ENDIAN)
+        if self.session:
+            return SESSION_HEADER.pack(self._header(), self.session)
 
+        return HEADER.pack(self._header())
+
+    def _header(self) -> int:
+        """
+        Flags and operation code of the packet."""
 
-class TransportAckPacket(TransportPacket):
+        flags = self.flags
+        if self.sequence_bytes != SEQUENCE_BYTES:
+            flags |= WIDE_SEQUENCE
+        if self.session:
+            flags |= SESSION
+
+        return flags << FLAGS_SHIFT | self._code
+
+
+class TransportSequencePacket(TransportPacket):
     """
-    Acknowledgement packet for a data packet."""
+    Base class for the packets that only carry a sequence number."""
 
-    def __init__(self, sequence: int):
-        """
-        The sequence number corresponds to the one from
-        the DATA packet being acknowledged."""
+    __slots__ = ("sequence",)
+
+    def __init__(self, sequence: int, sequence_bytes: int = SEQUENCE_BYTES):
+        super().__init__(sequence_bytes)
         self.sequence = sequence
 
+    @classmethod
+    def decode(
+        cls,
+        stream: bytes,
+        sequence_bytes: int = SEQUENCE_BYTES,
+        session: bool = False,
+    ) -> "TransportSequencePacket":
+        headers = ACK_SESSION_HEADER if session else ACK_HEADER
+        id = headers[sequence_bytes].unpack_from(stream)[-1]
+
+        return cls(id, sequence_bytes)
+
+    def encode(self) -> bytes:
+        if self.session:
+            header = ACK_SESSION_HEADER[self.sequence_bytes]
+            return header.pack(self._header(), self.session, self.sequence)
+
+        return ACK_HEADER[self.sequence_bytes].pack(self._header(), self.sequence)
+
+
+class TransportAckPacket(TransportSequencePacket):
+    """
+    Acknowledgement packet for a data packet. The sequence number
+    corresponds to the one from the DATA packet being acknowledged."""
+
+    __slots__ = ()
+
     @classmethod
     def _opcode(cls) -> int:
         return _CODES.ACK
 
+
+class TransportFinPacket(TransportSequencePacket):
+    """
+    Announces that the sender has finished sending packets, and that
+    every packet it sent has been acknowledged. The sequence number is
+    the one that its next data packet would have had."""
+
+    __slots__ = ()
+
     @classmethod
-    def decode(cls, stream: bytes) -> "TransportAckPacket":
-        id = int.from_bytes(stream[:2], ENDIAN)
+    def _opcode(cls) -> int:
+        return _CODES.FIN
 
-        return cls(id)
 
-    def encode(self) -> bytes:
-        return super().encode() + self.sequence.to_bytes(2, ENDIAN)
+class TransportFinAckPacket(TransportSequencePacket):
+    """
+    Acknowledgement of a FIN packet, with the same sequence number. Once
+    it is received, the sender of the FIN can release its stream."""
+
+    __slots__ = ()
+
+    @classmethod
+    def _opcode(cls) -> int:
+        return _CODES.FIN_ACK
 
 
 class TransportDataPacket(TransportPacket):
     """
     Data packet for reliable transport."""
 
-    def __init__(self, sequence: int, data: bytes):
+    __slots__ = ("sequence", "length", "data")
+
+    def __init__(
+        self, sequence: int, data: Payload, sequence_bytes: int = SEQUENCE_BYTES
+    ):
         """
         The sequence number is used to identify the packet and
-        to acknowledge it. The data is the payload of the packet."""
+        to acknowledge it. The data is the payload of the packet,
+        which may be given in several parts."""
 
+        super().__init__(sequence_bytes)
         self.sequence = sequence
-        self.length = len(data)
         self.data = data
+        if isinstance(data, tuple):
+            self.length = sum(len(part) for part in data)
+        else:
+            self.length = len(data)
 
     @classmethod
     def _opcode(cls) -> int:
         return _CODES.DATA
 
     @classmethod
-    def decode(cls, stream: bytes) -> "TransportDataPacket":
-        id = int.from_bytes(stream[:2], ENDIAN)
-        length = int.from_bytes(stream[2:4], ENDIAN)
-        data = stream[4:]
-
-        packet = cls(id, data)
+    def decode(
+        cls,
+        stream: bytes,
+        sequence_bytes: int = SEQUENCE_BYTES,
+        session: bool = False,
+    ) -> "TransportDataPacket":
+        header = (DATA_SESSION_HEADER if session else DATA_HEADER)[sequence_bytes]
+        id, length = header.unpack_from(stream)[-2:]
+        data = stream[header.size :]
+
+        packet = cls(id, data, sequence_bytes)
         packet.length = length
 
         return packet
 
     def encode(self) -> bytes:
-        return (
-            super().encode()
-            + self.sequence.to_bytes(2, ENDIAN)
-            + self.length.to_bytes(2, ENDIAN)
-            + self.data
-        )
+        """
+        Encodes the packet. The header and every part of the payload are
+        joined into a new buffer, which is the only copy of the payload
+        made while sending it."""
+
+        if self.session:
+            header = DATA_SESSION_HEADER[self.sequence_bytes].pack(
+                self._header(), self.session, self.sequence, self.length
+            )
+        else:
+            header = DATA_HEADER[self.sequence_bytes].pack(
+                self._header(), self.sequence, self.length
+            )
+
+        if isinstance(self.data, tuple):
+            return b"".join((header, *self.data))
+
+        return header + self.data
+
+
+class TransportSackPacket(TransportPacket):
+    """
+    Selective acknowledgement packet. Acknowledges every packet before
+    the cumulative sequence number, and every packet inside the ranges.
+    It also advertises the window of the receiver: the amount of packets,
+    starting at the cumulative sequence number, that it can hold.
+
+    |2 bytes |2 bytes    |2 bytes |1 byte |2 bytes |2 bytes |...
+    |Opcode  |Cumulative |Window  |Count  |Start   |End     |...
+
+    Ranges include the start sequence number and exclude the end
+    sequence number. With wide sequence numbers, every sequence number
+    takes 4 bytes instead of 2."""
+
+    __slots__ = ("cumulative", "window", "ranges")
+
+    def __init__(
+        self,
+        cumulative: int,
+        window: int,
+        ranges: List[Tuple[int, int]],
+        sequence_bytes: int = SEQUENCE_BYTES,
+    ):
+        """
+        The cumulative sequence number is the next sequence number that
+        the receiver expects."""
+
+        super().__init__(sequence_bytes)
+        self.cumulative = cumulative
+        self.window = window
+        self.ranges = ranges[:MAX_SACK_RANGES]
+
+    @classmethod
+    def _opcode(cls) -> int:
+        return _CODES.SACK
+
+    @classmethod
+    def decode(
+        cls,
+        stream: bytes,
+        sequence_bytes: int = SEQUENCE_BYTES,
+        session: bool = False,
+    ) -> "TransportSackPacket":
+        header = (SACK_SESSION_HEADER if session else SACK_HEADER)[sequence_bytes]
+        range_struct = SACK_RANGE[sequence_bytes]
+
+        cumulative, window, count = header.unpack_from(stream)[-3:]
+        end = header.size + count * range_struct.size
+        if len(stream) < end:
+            raise InvalidPacketException()
+
+        ranges = list(range_struct.iter_unpack(stream[header.size : end]))
+
+        return cls(cumulative, window, ranges, sequence_bytes)
+
+    def encode(self) -> bytes:
+        range_struct = SACK_RANGE[self.sequence_bytes]
+        fields = (self.cumulative, self.window, len(self.ranges))
+
+        if self.session:
+            header = SACK_SESSION_HEADER[self.sequence_bytes]
+            prefix = (self._header(), self.session)
+        else:
+            header = SACK_HEADER[self.sequence_bytes]
+            prefix = (self._header(),)
+
+        encoded = bytearray(header.size + len(self.ranges) * range_struct.size)
+        header.pack_into(encoded, 0, *prefix, *fields)
+        offset = header.size
+        for start, end in self.ranges:
+            range_struct.pack_into(encoded, offset, start, end)
+            offset += range_struct.size
+
+        return encoded
@@ -1,10 +1,20 @@
 #!/usr/bin/python3
 
 from argparse import ArgumentParser
-from lib.constants import LOCALHOST, DEFAULT_STORAGE
+from multiprocessing import Process
+from lib.constants import (
+    LOCALHOST,
+    DEFAULT_STORAGE,
+    MAX_CLIENT_TRANSFERS,
+    MAX_PENDING,
+    MAX_TRANSFERS,
+    CACHE_SIZE,
+)
 from lib.logger import create_logger, quiet_log, verbose_log
 
 from lib.server.server import Server
+from lib.transport.congestion import CONGESTION_CONTROLLERS
+from lib.transport.consts import CONGESTION
 
 SERVER_BUFF_SIZE = 512
 
@@ -13,7 +23,9 @@ def start_parser() -> "ArgumentParser":
     parser = ArgumentParser(
         prog="server RFTP",
         description="RFTP server",
-        usage="start-server [-h] [-v | -q] [-H ADDR] [-p PORT] [-s DIRPATH]",
+        usage="start-server [-h] [-v | -q] [-H ADDR] [-p PORT] [-s DIRPATH] "
+        + "[-c ALGORITHM] [-w WORKERS] [--max-transfers N] [--max-pending N] "
+        + "[--max-client-transfers N] [-m] [--cache-size BYTES]",
     )
 
     group = parser.add_mutually_exclusive_group()
@@ -31,14 +43,91 @@ def start_parser() -> "ArgumentParser":
     parser.add_argument(
         "-s", "--storage", default=DEFAULT_STORAGE, type=str, help="storage dir path"
     )
+    parser.add_argument(
+        "-c",
+        "--congestion",
+        choices=CONGESTION_CONTROLLERS.keys(),
+        default=CONGESTION,
+        help="congestion control algorithm",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        default=1,
+        type=int,
+        help="amount of server processes sharing the port",
+    )
+    parser.add_argument(
+        "--max-transfers",
+        default=MAX_TRANSFERS,
+        type=int,
+        help="maximum amount of simultaneous transfers",
+    )
+    parser.add_argument(
+        "--max-pending",
+        default=MAX_PENDING,
+        type=int,
+        help="maximum amount of requests waiting for a transfer slot",
+    )
+    parser.add_argument(
+        "--max-client-transfers",
+        default=MAX_CLIENT_TRANSFERS,
+        type=int,
+        help="maximum amount of simultaneous transfers of a single client",
+    )
+    parser.add_argument(
+        "-m",
+        "--multiplex",
+        action="store_true",
+        help="multiplex transfers over the listening socket",
+    )
+    parser.add_argument(
+        "--cache-size",
+        default=CACHE_SIZE,
+        type=int,
+        help="bytes of downloaded files kept in memory (0 disables the cache)",
+    )
 
     return parser
 
 
 def main(arguments):
+    if arguments.workers <= 1:
+        serve(arguments, False)
+        return
+
+    processes = [
+        Process(target=serve, args=(arguments, True), daemon=True)
+        for _ in range(arguments.workers)
+    ]
+    for process in processes:
+        process.start()
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        exit()
+
+
+def serve(arguments, reuse_port: bool):
+    """
+    Accepts requests until interrupted. With reuse_port, the server
+    shares its address with the servers of the other processes."""
+
     create_logger(arguments.verbose, arguments.quiet)
     listen_address = (arguments.host, arguments.port)
-    server = Server(listen_address, arguments.storage)
+    server = Server(
+        listen_address,
+        arguments.storage,
+        arguments.congestion,
+        reuse_port,
+        arguments.max_transfers,
+        arguments.max_pending,
+        arguments.max_client_transfers,
+        arguments.multiplex,
+        arguments.cache_size,
+    )
     while True:
         verbose_log(f"Waiting for requests at: {listen_address}")
         try: